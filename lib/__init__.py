@@ -1,6 +1,7 @@
 import os
 import config
 from lib.db import db
+from lib import cache, metrics, replicas, storage
 from lib.routes import models_bp, users_bp, bp
 from flask import Flask
 from flask_mail import Mail
@@ -22,12 +23,47 @@ def create_app(package_name=__name__, **config_overrides):
     db.init_app(app)
     Migrate(app, db)
 
+    # Read replicas, for read-only requests
+    replicas.init_app(app)
+
     # Setup security
     from . import models
     app.user_db = SQLAlchemyUserDatastore(db, models.User, models.Role)
-    Security(app, app.user_db)
+    security = Security(app, app.user_db)
     app.mail = Mail(app)
 
+    # Send security mails (confirmation, password reset...)
+    # from a background queue instead of within requests
+    if app.config['MAIL_QUEUE_SIZE']:
+        from .mailer import MailQueue
+        app.mail_queue = MailQueue(app, app.mail)
+        security.send_mail_task(app.mail_queue.put)
+
+    # Latency histograms and counters, served at /metrics
+    metrics.init_app(app)
+
+    # Per-thread cache of open repos (repos aren't thread-safe)
+    app.repo_cache = cache.ThreadLocalCache(app.config['REPO_CACHE_SIZE'],
+                                            on_evict=models.model.close_repo)
+
+    # Verified auth token cache
+    app.token_cache = cache.LRUCache(app.config['AUTH_TOKEN_CACHE_SIZE'],
+                                     ttl=app.config['AUTH_TOKEN_CACHE_TTL'])
+
+    # Model metadata cache
+    app.meta_cache = cache.from_config(app.config, 'META')
+
+    # Search and autocomplete results, cleared on changes to models
+    app.search_cache = cache.LRUCache(app.config['SEARCH_CACHE_SIZE'],
+                                      ttl=app.config['SEARCH_CACHE_TTL'])
+
+    # Archive storage
+    app.archive_storage = storage.from_config(app.config)
+
+    # Background archive builds
+    from .builds import ArchiveBuilder
+    app.archive_builder = ArchiveBuilder(app)
+
     # Create the database tables.
     # Flask-SQLAlchemy needs to know which
     # app context to create the tables in.
@@ -0,0 +1,94 @@
+import gzip
+import shutil
+import hashlib
+import tarfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _gzip(src, dest):
+    # mtime is fixed so rebuilds produce identical bytes
+    with open(src, 'rb') as f_in, open(dest, 'wb') as f_out:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f_out, mtime=0) as f_gz:
+            shutil.copyfileobj(f_in, f_gz)
+
+
+def _zstd(src, dest):
+    with open(src, 'rb') as f_in, open(dest, 'wb') as f_out:
+        zstandard.ZstdCompressor().copy_stream(f_in, f_out)
+
+
+# content encodings archives are precompressed with,
+# in order of preference, as (encoding, file suffix, compressor)
+COMPRESSORS = [('gzip', '.gz', _gzip)]
+if zstandard is not None:
+    COMPRESSORS.insert(0, ('zstd', '.zst', _zstd))
+
+SUFFIXES = {encoding: suffix for encoding, suffix, _ in COMPRESSORS}
+
+
+def variant_path(path, encoding=None):
+    """path of an archive's variant for the encoding"""
+    if encoding is None:
+        return path
+    return path + SUFFIXES[encoding]
+
+
+def open_tar(path_or_file):
+    """opens a tar archive, given its path or an open file
+    (which is read from the start, and left open)"""
+    if isinstance(path_or_file, str):
+        return tarfile.open(path_or_file)
+    path_or_file.seek(0)
+    return tarfile.open(fileobj=path_or_file)
+
+
+def digest(path_or_file, chunk_size=64 * 1024):
+    """sha256 hex digest of a file's (or file object's) contents"""
+    sha = hashlib.sha256()
+    f = open(path_or_file, 'rb') if isinstance(path_or_file, str) else path_or_file
+    try:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    finally:
+        f.close()
+    return sha.hexdigest()
+
+
+def compress(path):
+    """writes all compressed variants of an archive,
+    returns a dict of the encodings written to their variant's digest"""
+    encodings = {}
+    for encoding, suffix, compressor in COMPRESSORS:
+        compressor(path, path + suffix)
+        encodings[encoding] = digest(path + suffix)
+    return encodings
+
+
+def negotiate(accept_encodings, encodings):
+    """picks the client's preferred encoding out of the available ones,
+    falling back to our order of preference for ties.
+    returns None if the archive should be sent uncompressed"""
+    preferred = [e for e, _, _ in COMPRESSORS if e in encodings]
+    best, best_quality = None, 0
+    for encoding in preferred:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def member_window(path_or_file, name):
+    """returns the (offset, size) of a file's data
+    within an (uncompressed) tar archive (or open archive file), or None"""
+    with open_tar(path_or_file) as tar:
+        try:
+            member = tar.getmember(name)
+        except KeyError:
+            return None
+    if not member.isfile():
+        return None
+    return member.offset_data, member.size
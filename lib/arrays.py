@@ -0,0 +1,115 @@
+# binary model payloads are a little-endian uint32 header length,
+# a json header describing the arrays, then the raw array data:
+#
+#   <header length>{"arrays": {"<name>": {"dtype": "<f4", "shape": [2, 3],
+#                                         "offset": 0, "nbytes": 24}, ...}}<data>
+#
+# offsets are relative to the start of the data. array data is stored
+# little-endian, so it can be served (and memory-mapped by clients)
+# without being deserialized.
+import json
+import struct
+from lib import archives
+from lib.excs import PayloadException
+
+FILENAME = 'model.bin'
+HEADER_LENGTH = struct.Struct('<I')
+
+
+def pack(arrays, fileobj):
+    """writes arrays to a file object in the binary payload format.
+    `arrays` maps names either to numpy arrays
+    or to (dtype, shape, bytes) tuples"""
+    header, chunks, offset = {}, [], 0
+    for name, array in sorted(arrays.items()):
+        if hasattr(array, 'dtype'):
+            if array.dtype.byteorder == '>':
+                array = array.astype(array.dtype.newbyteorder('<'))
+            array = array.dtype.str, array.shape, array.tobytes()
+        dtype, shape, data = array
+        header[name] = {'dtype': dtype, 'shape': list(shape),
+                        'offset': offset, 'nbytes': len(data)}
+        chunks.append(data)
+        offset += len(data)
+
+    header = json.dumps({'arrays': header}).encode('utf-8')
+    fileobj.write(HEADER_LENGTH.pack(len(header)))
+    fileobj.write(header)
+    for data in chunks:
+        fileobj.write(data)
+
+
+def read_header(fileobj):
+    """reads the header of a payload, starting at the file object's
+    current position. returns the arrays' descriptions
+    and the data's offset from that position"""
+    try:
+        length, = HEADER_LENGTH.unpack(fileobj.read(HEADER_LENGTH.size))
+        arrays = json.loads(fileobj.read(length).decode('utf-8'))['arrays']
+    except (struct.error, ValueError, KeyError, TypeError):
+        raise PayloadException('Invalid binary payload header')
+    if not isinstance(arrays, dict):
+        raise PayloadException('Invalid binary payload header')
+    return arrays, HEADER_LENGTH.size + length
+
+
+def is_size(value):
+    """whether a value is a valid offset, length or dimension"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def validate(path):
+    """checks that a payload file's header
+    describes its arrays fully and matches its data"""
+    with open(path, 'rb') as f:
+        arrays, data_offset = read_header(f)
+        f.seek(0, 2)
+        data_length = f.tell() - data_offset
+    for name, array in arrays.items():
+        if not isinstance(array, dict) \
+                or not isinstance(array.get('dtype'), str) \
+                or not isinstance(array.get('shape'), list) \
+                or not all(is_size(d) for d in array['shape']) \
+                or not is_size(array.get('offset')) \
+                or not is_size(array.get('nbytes')):
+            raise PayloadException('Invalid description of array {}'.format(name))
+        if array['offset'] + array['nbytes'] > data_length:
+            raise PayloadException('Array {} is out of bounds'.format(name))
+
+
+def seek_array(fileobj, name, chunk_size=64 * 1024):
+    """reads a payload's header from a (non-seekable) file object and
+    advances it to the start of an array's data.
+    returns the array's description, or None if there's no such array"""
+    arrays, _ = read_header(fileobj)
+    if name not in arrays:
+        return None
+    remaining = arrays[name]['offset']
+    while remaining > 0:
+        chunk = fileobj.read(min(remaining, chunk_size))
+        if not chunk:
+            raise PayloadException('Array {} is out of bounds'.format(name))
+        remaining -= len(chunk)
+    return arrays[name]
+
+
+def locate(path_or_file, name):
+    """finds an array within the payload of a (uncompressed) tar archive
+    (or open archive file). returns the array's description
+    and its absolute offset in the archive"""
+    with archives.open_tar(path_or_file) as tar:
+        try:
+            member = tar.getmember(FILENAME)
+        except KeyError:
+            return None, None
+    f = open(path_or_file, 'rb') if isinstance(path_or_file, str) else path_or_file
+    try:
+        f.seek(member.offset_data)
+        arrays, data_offset = read_header(f)
+    finally:
+        if f is not path_or_file:
+            f.close()
+    if name not in arrays:
+        return None, None
+    array = arrays[name]
+    return array, member.offset_data + data_offset + array['offset']
@@ -0,0 +1,34 @@
+from sqlalchemy import event
+from lib.models import User
+from flask import current_app, has_app_context
+from flask_security.core import _token_loader
+
+
+def verify_token(token):
+    """returns the id of the user the auth token belongs to,
+    or None if the token is invalid. verified tokens are
+    cached for a short time, so that bursts of requests
+    don't each deserialize the token and load the user"""
+    if not token:
+        return None
+    user_id = current_app.token_cache.get(token)
+    if user_id is None:
+        user = _token_loader(token)
+        user_id = getattr(user, 'id', None)
+        if user_id is None:
+            return None
+        current_app.token_cache.set(token, user_id)
+    return user_id
+
+
+def invalidate_user(user_id):
+    """forgets all cached tokens of a user"""
+    current_app.token_cache.invalidate_where(lambda id: id == user_id)
+
+
+@event.listens_for(User.password, 'set')
+@event.listens_for(User.active, 'set')
+def credentials_changed(user, value, oldvalue, initiator):
+    """password changes and deactivation invalidate the user's tokens"""
+    if has_app_context() and user.id is not None:
+        invalidate_user(user.id)
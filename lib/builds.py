@@ -0,0 +1,45 @@
+import logging
+from lib.db import db
+from lib.models import Model
+from lib.models.version import FAILED
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveBuilder(object):
+    """builds version archives on a pool of background workers.
+    with no workers configured, archives are built immediately"""
+
+    def __init__(self, app):
+        self.app = app
+        workers = app.config['ARCHIVE_WORKERS']
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+
+    def submit(self, model, version):
+        """queues an archive build for a published (and committed) version"""
+        if self.executor is None:
+            self.build(model, version)
+        else:
+            self.executor.submit(self._build, model.id, version)
+
+    def build(self, model, version):
+        """builds the archive and records the build's outcome"""
+        try:
+            model.make_archive(version)
+        except Exception:
+            logger.exception('Archive build failed for {} {}'.format(model.name, version))
+            db.session.rollback()
+            row = model.version_row(version)
+            if row is None:
+                # the version was deleted in the meantime
+                return
+            row.archive_status = FAILED
+        db.session.add(model)
+        db.session.commit()
+
+    def _build(self, model_id, version):
+        with self.app.app_context():
+            model = Model.query.get(model_id)
+            if model is not None:
+                self.build(model, version)
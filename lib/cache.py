@@ -0,0 +1,203 @@
+import json
+import time
+import weakref
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """a thread-safe, size-bounded cache which
+    evicts the least recently used entries first.
+    if a ttl (in seconds) is given, entries also expire.
+    if given, `on_evict` is called with each value that is
+    evicted, expired, invalidated or replaced"""
+
+    def __init__(self, maxsize, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evicted(self, values):
+        # called outside of the lock
+        if self.on_evict is not None:
+            for value in values:
+                self.on_evict(value)
+
+    def get(self, key, default=None):
+        """returns the cached value for the key,
+        marking it as recently used"""
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            expired = expires is not None and expires <= time.time()
+            if expired:
+                self.misses += 1
+            else:
+                self._entries[key] = value, expires
+                self.hits += 1
+        if expired:
+            self._evicted([value])
+            return default
+        return value
+
+    def set(self, key, value):
+        """caches a value, evicting the least
+        recently used entries if the cache is full"""
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None and previous[0] is not value:
+                evicted.append(previous[0])
+            self._entries[key] = value, expires
+            while len(self._entries) > self.maxsize:
+                evicted.append(self._entries.popitem(last=False)[1][0])
+        self._evicted(evicted)
+
+    def invalidate(self, key):
+        """removes the key from the cache, if present"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._evicted([entry[0]])
+
+    def invalidate_where(self, predicate):
+        """removes all entries whose value satisfies the predicate"""
+        with self._lock:
+            evicted = [(k, v) for k, (v, _) in self._entries.items() if predicate(v)]
+            for key, _ in evicted:
+                del self._entries[key]
+        self._evicted([v for _, v in evicted])
+
+    def clear(self):
+        with self._lock:
+            evicted = [v for v, _ in self._entries.values()]
+            self._entries.clear()
+        self._evicted(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class ThreadLocalCache(object):
+    """an LRUCache per thread, for values which mustn't be
+    shared between threads. each thread's cache holds up to
+    `maxsize` entries; stats are summed over all threads"""
+
+    def __init__(self, maxsize, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._local = threading.local()
+        # the caches of live threads, for stats
+        self._caches = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    @property
+    def _cache(self):
+        cache = getattr(self._local, 'cache', None)
+        if cache is None:
+            cache = self._local.cache = LRUCache(self.maxsize, ttl=self.ttl, on_evict=self.on_evict)
+            with self._lock:
+                self._caches.add(cache)
+        return cache
+
+    def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def invalidate(self, key):
+        """removes the key from the calling thread's cache"""
+        self._cache.invalidate(key)
+
+    def clear(self):
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    @property
+    def stats(self):
+        with self._lock:
+            caches = list(self._caches)
+        return {
+            'size': sum(len(cache) for cache in caches),
+            'maxsize': self.maxsize,
+            'threads': len(caches),
+            'hits': sum(cache.hits for cache in caches),
+            'misses': sum(cache.misses for cache in caches)
+        }
+
+
+class SharedCache(object):
+    """a cache shared between processes, backed by a redis-like
+    client (anything with `get`, `setex` and `delete`).
+    values must be json-serializable; entries expire after the ttl"""
+
+    def __init__(self, client, prefix, ttl):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, key):
+        return '{}:{}'.format(self.prefix, json.dumps(key))
+
+    def get(self, key, default=None):
+        value = self.client.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.client.setex(self._key(key), self.ttl, json.dumps(value))
+
+    def invalidate(self, key):
+        self.client.delete(self._key(key))
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+def from_config(config, name):
+    """builds the cache configured by the
+    `<name>_CACHE_*` settings of the config"""
+    prefix = '{}_CACHE_'.format(name)
+    if config.get(prefix + 'BACKEND', 'local') == 'redis':
+        import redis
+        client = redis.StrictRedis.from_url(config[prefix + 'REDIS_URL'])
+        return SharedCache(client, name.lower(), config[prefix + 'TTL'])
+    return LRUCache(config[prefix + 'SIZE'], ttl=config[prefix + 'TTL'])
@@ -0,0 +1,173 @@
+import os
+import shutil
+import hashlib
+import tarfile
+import tempfile
+from os import path
+from collections import Counter
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from lib.db import db
+from lib.models.chunk import Chunk
+
+# chunks are stored under this prefix of the archive storage,
+# assembled archives under this dir of ARCHIVE_DIR
+PREFIX = '.chunks'
+CACHE_DIR = '.assembled'
+
+
+def key(sha256):
+    """storage key of a chunk"""
+    return '{}/{}/{}'.format(PREFIX, sha256[:2], sha256)
+
+
+def boundaries(archive_path, chunk_size, min_size):
+    """splits a tar archive into (start, stop) byte ranges.
+    the data of each member of at least `min_size` bytes gets ranges
+    of its own, so that files shared between versions (whose tar headers
+    differ) are chunked identically. headers and smaller members are
+    grouped in between. ranges are at most `chunk_size` long"""
+    spans, start = [], 0
+    with tarfile.open(archive_path) as tar:
+        for member in tar:
+            if member.size >= min_size:
+                stop = member.offset_data + member.size
+                spans.append((start, member.offset_data))
+                spans.append((member.offset_data, stop))
+                start = stop
+    spans.append((start, path.getsize(archive_path)))
+    return [(offset, min(offset + chunk_size, stop))
+            for start, stop in spans
+            for offset in range(start, stop, chunk_size)]
+
+
+def lock(sha256):
+    """locks a chunk's row until the end of the transaction,
+    creating it (without references) if it doesn't exist"""
+    query = Chunk.query.filter_by(sha256=sha256).with_for_update().populate_existing()
+    chunk = query.first()
+    if chunk is None:
+        try:
+            with db.session.begin_nested():
+                chunk = Chunk(sha256=sha256, refs=0)
+                db.session.add(chunk)
+        except IntegrityError:
+            # created concurrently
+            chunk = query.one()
+    return chunk
+
+
+def store(archive_path, scratch_dir):
+    """stores an archive as chunks, returns the archive's manifest,
+    the list of its chunks' digests. each chunk is locked while it's
+    referenced (in digest order, so concurrent stores and releases can't
+    deadlock), and uploaded unless it's already referenced: the blobs of
+    unreferenced chunks may be missing, or being deleted by `collect`"""
+    storage = current_app.archive_storage
+    spans = boundaries(archive_path, current_app.config['CHUNK_SIZE'],
+                       current_app.config['CHUNK_MIN_SIZE'])
+    manifest = []
+    with open(archive_path, 'rb') as f:
+        for start, stop in spans:
+            f.seek(start)
+            manifest.append(hashlib.sha256(f.read(stop - start)).hexdigest())
+
+        counts = Counter(manifest)
+        chunk_spans = dict(zip(manifest, spans))
+        for sha256 in sorted(counts):
+            chunk = lock(sha256)
+            if chunk.refs <= 0:
+                start, stop = chunk_spans[sha256]
+                f.seek(start)
+                chunk_path = path.join(scratch_dir, sha256)
+                with open(chunk_path, 'wb') as chunk_file:
+                    chunk_file.write(f.read(stop - start))
+                storage.put(key(sha256), chunk_path)
+                chunk.size = stop - start
+            chunk.refs += counts[sha256]
+    # written now, so that later updates (e.g. `release`) apply on top
+    db.session.flush()
+    return manifest
+
+
+def release(manifest):
+    """drops an archive's references to its chunks (in digest order,
+    like `store`). chunks no longer referenced are deleted by `collect`"""
+    counts = Counter(manifest)
+    for sha256 in sorted(counts):
+        Chunk.query.filter_by(sha256=sha256) \
+            .update({Chunk.refs: Chunk.refs - counts[sha256]}, synchronize_session=False)
+
+
+def collect():
+    """deletes the chunks no longer referenced by any archive, each in a
+    transaction of its own. a chunk's blob is deleted under its row's lock,
+    so a concurrent `store` of the chunk waits, then uploads it again.
+    returns the number of chunks deleted"""
+    storage = current_app.archive_storage
+    garbage = [sha256 for sha256, in db.session.query(Chunk.sha256).filter(Chunk.refs <= 0)]
+    db.session.commit()
+    deleted = 0
+    for sha256 in garbage:
+        chunk = Chunk.query.filter(Chunk.sha256 == sha256, Chunk.refs <= 0) \
+            .with_for_update().populate_existing().first()
+        if chunk is not None:
+            storage.delete(key(sha256))
+            db.session.delete(chunk)
+            deleted += 1
+        db.session.commit()
+    return deleted
+
+
+def assemble(manifest, digest):
+    """returns a chunked archive opened for reading, assembling it
+    if it's not cached. up to `CHUNK_CACHE_SIZE` assembled archives
+    are kept, least recently used ones are evicted. the open file pins
+    the archive: evicting it only unlinks it, so it can still be sent"""
+    cache_dir = path.join(current_app.config['ARCHIVE_DIR'], CACHE_DIR)
+    archive_path = path.join(cache_dir, '{}.tar'.format(digest))
+    try:
+        f = open(archive_path, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        try:
+            os.utime(archive_path, None)
+        except OSError:
+            # evicted in the meantime
+            pass
+        return f
+
+    os.makedirs(cache_dir, exist_ok=True)
+    storage = current_app.archive_storage
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for sha256 in manifest:
+                chunk = storage.open(key(sha256))
+                try:
+                    shutil.copyfileobj(chunk, tmp)
+                finally:
+                    chunk.close()
+        # opened before it can be evicted, and renamed
+        # into place so concurrent readers never see partial archives
+        f = open(tmp_path, 'rb')
+        os.rename(tmp_path, archive_path)
+    except Exception:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict(cache_dir, current_app.config['CHUNK_CACHE_SIZE'])
+    return f
+
+
+def evict(cache_dir, size):
+    """removes the least recently used assembled archives beyond `size`"""
+    paths = [path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.tar')]
+    paths.sort(key=lambda p: path.getmtime(p) if path.exists(p) else 0, reverse=True)
+    for archive_path in paths[size:]:
+        try:
+            os.remove(archive_path)
+        except OSError:
+            # already evicted by another worker
+            pass
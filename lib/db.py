@@ -1,5 +1,25 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy.sql.expression import UpdateBase
 from sqlalchemy_searchable import make_searchable
 
-db = SQLAlchemy(session_options={'autoflush': False})
+
+class RoutingSession(SignallingSession):
+    """a session which runs the queries of read-only requests
+    on the replica picked for the request (see `lib.replicas`).
+    flushes and other writes always go to the primary"""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('replica') if has_app_context() else None
+        if replica is not None and not self._flushing and not isinstance(clause, UpdateBase):
+            return replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+
+db = RoutingSQLAlchemy(session_options={'autoflush': False})
 make_searchable()
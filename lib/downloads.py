@@ -0,0 +1,150 @@
+import os
+import mmap
+from os import path
+from flask import request, current_app, Response
+from werkzeug.http import unquote_etag
+from werkzeug.urls import url_quote
+from werkzeug.datastructures import ContentRange
+
+
+def not_modified(etag):
+    """returns a 304 response if the client
+    already has the representation with this etag"""
+    if etag is not None and request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+    return None
+
+
+def requested_range(etag, length):
+    """returns the (start, stop) byte range requested by the client,
+    None if the full content should be sent,
+    or False if the range can't be satisfied"""
+    rng = request.range
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) != 1:
+        return None
+
+    # only honor the range if the client's copy is still current
+    if_range = request.headers.get('If-Range')
+    if if_range is not None and unquote_etag(if_range)[0] != etag:
+        return None
+
+    return rng.range_for_length(length) or False
+
+
+def read_chunks(f, start, stop):
+    """yields the bytes [start, stop) of an open file,
+    memory-mapped, and closes the file once they're sent"""
+    chunk_size = current_app.config['DOWNLOAD_CHUNK_SIZE']
+    try:
+        if stop <= start:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(start, stop, chunk_size):
+                yield mm[offset:min(offset + chunk_size, stop)]
+        finally:
+            mm.close()
+    finally:
+        f.close()
+
+
+def offloaded(filepath, etag, mimetype):
+    """returns a response which hands the file off to the web server
+    (via X-Accel-Redirect or X-Sendfile, per `DOWNLOAD_OFFLOAD`),
+    or None if the file can't be offloaded"""
+    offload = current_app.config['DOWNLOAD_OFFLOAD']
+    if offload is None:
+        return None
+
+    resp = Response(mimetype=mimetype)
+    if offload == 'nginx':
+        # nginx serves ARCHIVE_DIR under an internal location
+        rel_path = path.relpath(filepath, current_app.config['ARCHIVE_DIR'])
+        if rel_path.startswith(path.pardir):
+            return None
+        # model names and versions are arbitrary, so the
+        # path is quoted (nginx takes it as a uri)
+        resp.headers['X-Accel-Redirect'] = current_app.config['DOWNLOAD_ACCEL_PREFIX'] + url_quote(rel_path, safe='/')
+    elif offload == 'sendfile':
+        # unquoted by the web server (e.g. mod_xsendfile's XSendFileUnescape)
+        resp.headers['X-Sendfile'] = url_quote(path.abspath(filepath), safe='/')
+    else:
+        raise ValueError('Unknown DOWNLOAD_OFFLOAD: {}'.format(offload))
+    resp.set_etag(etag)
+    return resp
+
+
+def send_file(path_or_file, etag, mimetype, offset=0, length=None):
+    """sends a file (or an open file, which is closed once sent) with
+    a strong etag, honoring If-None-Match and single byte ranges.
+    the file is opened right away, so it can still be sent if it's
+    removed meanwhile. if offset and length are given, only that window
+    of the file is sent"""
+    is_path = isinstance(path_or_file, str)
+    resp = not_modified(etag)
+    if resp is None and is_path and offset == 0 and length is None:
+        resp = offloaded(path_or_file, etag, mimetype)
+    if resp is not None:
+        if not is_path:
+            path_or_file.close()
+        return resp
+
+    f = open(path_or_file, 'rb') if is_path else path_or_file
+    if length is None:
+        length = os.fstat(f.fileno()).st_size - offset
+    rng = requested_range(etag, length)
+    if rng is False:
+        f.close()
+        resp = Response(status=416)
+        resp.headers['Content-Range'] = 'bytes */{}'.format(length)
+        return resp
+
+    start, stop = rng or (0, length)
+    resp = Response(read_chunks(f, offset + start, offset + stop),
+                    mimetype=mimetype,
+                    direct_passthrough=True)
+    if rng is not None:
+        resp.status_code = 206
+        resp.content_range = ContentRange('bytes', start, stop, length)
+    resp.content_length = stop - start
+    resp.accept_ranges = 'bytes'
+    resp.set_etag(etag)
+    return resp
+
+
+def read_stream(stream, start, stop):
+    """yields the bytes [start, stop) of a (non-seekable) stream.
+    the bytes before `start` are read and skipped"""
+    chunk_size = current_app.config['DOWNLOAD_CHUNK_SIZE']
+    position = 0
+    while position < stop:
+        chunk = stream.read(min(chunk_size, stop - position))
+        if not chunk:
+            return
+        if position + len(chunk) > start:
+            yield chunk[max(start - position, 0):]
+        position += len(chunk)
+
+
+def send_stream(stream, length, etag, mimetype):
+    """sends the contents of a (non-seekable) stream of a known length
+    with a strong etag, honoring single byte ranges"""
+    rng = requested_range(etag, length)
+    if rng is False:
+        resp = Response(status=416)
+        resp.headers['Content-Range'] = 'bytes */{}'.format(length)
+        return resp
+
+    start, stop = rng or (0, length)
+    resp = Response(read_stream(stream, start, stop),
+                    mimetype=mimetype,
+                    direct_passthrough=True)
+    if rng is not None:
+        resp.status_code = 206
+        resp.content_range = ContentRange('bytes', start, stop, length)
+    resp.content_length = stop - start
+    resp.accept_ranges = 'bytes'
+    resp.set_etag(etag)
+    return resp
@@ -3,3 +3,24 @@ class ModelNotFoundException(Exception):
 
 class ModelConflictException(Exception):
     pass
+
+class ChecksumMismatchException(Exception):
+    pass
+
+class ArchivePendingException(Exception):
+    pass
+
+class ArchiveFailedException(Exception):
+    pass
+
+class ArchivePrunedException(Exception):
+    pass
+
+class PatchException(Exception):
+    pass
+
+class PayloadException(Exception):
+    pass
+
+class InvalidVersionException(Exception):
+    pass
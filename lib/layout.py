@@ -0,0 +1,53 @@
+import os
+import hashlib
+from os import path
+
+
+# shards are kept in a directory of their own, apart from the
+# models in the flat layout (model names can't start with a dot)
+SHARDS = '.shards'
+
+
+def shard(name):
+    """the sharded path of a model's directory,
+    relative to the storage root, e.g. `.shards/ab/cd/<name>`"""
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return path.join(SHARDS, digest[:2], digest[2:4], name)
+
+
+def resolve(root, name, config):
+    """the path of a model's directory under a storage root,
+    according to the configured `STORAGE_LAYOUT`.
+    while migrating to the sharded layout (`STORAGE_LAYOUT_FALLBACK`),
+    models which haven't been moved yet are found at their flat path"""
+    flat_path = path.join(root, name)
+    if config['STORAGE_LAYOUT'] != 'sharded':
+        return flat_path
+    sharded_path = path.join(root, shard(name))
+    if config['STORAGE_LAYOUT_FALLBACK'] \
+            and not path.exists(sharded_path) and path.exists(flat_path):
+        return flat_path
+    return sharded_path
+
+
+def key(name, config):
+    """the key prefix of a model's directory in an object store, according
+    to the configured `STORAGE_LAYOUT`. unlike `resolve` it doesn't look
+    at the local filesystem, so there's no fallback to the flat layout"""
+    rel_path = shard(name) if config['STORAGE_LAYOUT'] == 'sharded' else name
+    return rel_path.replace(path.sep, '/')
+
+
+def migrate(root, name):
+    """moves a model's directory from the flat to the sharded layout.
+    the move is a rename, so readers see the directory at either path.
+    returns True if the directory was moved"""
+    flat_path = path.join(root, name)
+    sharded_path = path.join(root, shard(name))
+    if not path.exists(flat_path) or path.exists(sharded_path):
+        return False
+    parent = path.dirname(sharded_path)
+    if not path.exists(parent):
+        os.makedirs(parent)
+    os.rename(flat_path, sharded_path)
+    return True
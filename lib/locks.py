@@ -0,0 +1,26 @@
+from lib.db import db
+from lib.replicas import use_primary
+
+# namespace of the app's advisory locks (the first of postgres'
+# two lock keys), so they don't clash with other users of the db
+MODEL_LOCKS = 1
+CHANGE_LOCKS = 2
+
+
+def lock_model(model_id):
+    """takes an exclusive lock on a model, held until the end of
+    the current transaction. locks of different models don't block
+    each other, and a transaction can take the same lock repeatedly"""
+    use_primary()
+    db.session.execute('SELECT pg_advisory_xact_lock(:namespace, :key)',
+                       {'namespace': MODEL_LOCKS, 'key': model_id})
+
+
+def lock_changes():
+    """takes the lock serializing writes to the change log, held until
+    the end of the current transaction. change ids are allocated while
+    it's held, so they're in commit order and a reader that has seen
+    a change has seen all earlier ones"""
+    use_primary()
+    db.session.execute('SELECT pg_advisory_xact_lock(:namespace, 0)',
+                       {'namespace': CHANGE_LOCKS})
@@ -0,0 +1,115 @@
+import time
+import queue
+import logging
+import smtplib
+import threading
+from flask_mail import BadHeaderError
+
+logger = logging.getLogger(__name__)
+
+# errors which won't go away by retrying a message
+PERMANENT_ERRORS = (BadHeaderError, AssertionError)
+
+# errors in reply to a single message (rather than of the connection),
+# which are permanent or temporary depending on the reply's code
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                  smtplib.SMTPDataError)
+
+
+def permanent(error):
+    """whether retrying a message won't get it past `error`"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # all of the message's recipients were refused
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, MESSAGE_ERRORS):
+        # a 5xx reply is final, a 4xx one (e.g. greylisting) may not be
+        return 500 <= error.smtp_code < 600
+    return isinstance(error, PERMANENT_ERRORS)
+
+
+class MailQueue(object):
+    """sends mail off the request path. messages are put on a bounded
+    queue and sent by a background worker, in batches over one smtp
+    connection. failed batches are retried with a growing delay.
+    if the queue is full, messages are sent right away"""
+
+    def __init__(self, app, mail):
+        self.app = app
+        self.mail = mail
+        self.queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        self.batch_size = app.config['MAIL_BATCH_SIZE']
+        self.retries = app.config['MAIL_RETRIES']
+        self.retry_delay = app.config['MAIL_RETRY_DELAY']
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def put(self, msg):
+        """queues a message for sending"""
+        self._start()
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            logger.warning('Mail queue is full, sending right away')
+            self.mail.send(msg)
+
+    def join(self):
+        """blocks until all queued messages are sent (or given up on)"""
+        self.queue.join()
+
+    def _start(self):
+        # started lazily, so it runs in the process that sends the mail
+        # (and not in a parent that forks workers)
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._work, name='mail-queue')
+                self.worker.daemon = True
+                self.worker.start()
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.app.app_context():
+                    self.send_batch(batch)
+            except Exception:
+                logger.exception('Mail queue worker failed')
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def send_batch(self, batch):
+        """sends messages over one connection, retrying on connection
+        or server errors. a message the server defers is set aside and
+        retried after the rest. returns the number of messages sent"""
+        pending, sent = list(batch), 0
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            deferred = []
+            try:
+                with self.mail.connect() as conn:
+                    while pending:
+                        try:
+                            conn.send(pending[0])
+                            sent += 1
+                        except Exception as e:
+                            if permanent(e):
+                                logger.exception('Dropping undeliverable mail to {}'.format(pending[0].recipients))
+                            elif isinstance(e, MESSAGE_ERRORS):
+                                logger.warning('Mail to {} deferred: {}'.format(pending[0].recipients, e))
+                                deferred.append(pending[0])
+                            else:
+                                raise
+                        pending.pop(0)
+            except (smtplib.SMTPException, OSError):
+                logger.exception('Sending mail failed (attempt {} of {})'.format(attempt + 1, self.retries + 1))
+            pending = deferred + pending
+            if not pending:
+                return sent
+        logger.error('Dropping {} mails after {} attempts'.format(len(pending), self.retries + 1))
+        return sent
@@ -0,0 +1,142 @@
+import logging
+from datetime import datetime, timedelta
+from flask import current_app
+from lib.db import db
+from lib import archives
+from lib.excs import ModelNotFoundException
+from lib.models.version import PENDING, READY
+
+logger = logging.getLogger(__name__)
+
+
+def loose_objects(repo):
+    """number of loose objects in a repo"""
+    stats = dict(line.split(': ', 1) for line in repo.git.count_objects('-v').splitlines())
+    return int(stats['count'])
+
+
+def repack(model, threshold):
+    """repacks the model's repo if it has at least `threshold` loose objects.
+    returns the number of loose objects found"""
+    count = loose_objects(model.repo)
+    if count >= threshold:
+        # no publishes while the objects are moved around
+        model.lock()
+        model.repo.git.repack('-a', '-d', '-q')
+        model.repo.git.prune_packed()
+    return count
+
+
+def expired_versions(model, now, keep_versions=None, keep_days=None):
+    """versions whose archives fall outside the retention policy:
+    not among the last `keep_versions` versions, nor published within
+    the last `keep_days` days. the model's own policy overrides the given
+    defaults, with no policy at all everything is kept.
+    the latest version's archive is always kept"""
+    if model.keep_versions is not None or model.keep_days is not None:
+        keep_versions, keep_days = model.keep_versions, model.keep_days
+    if keep_versions is None and keep_days is None:
+        return []
+
+    expired = []
+    rows = [model.version_row(version) for version in reversed(model.versions)]
+    for i, row in enumerate(rows[1:], 1):
+        if keep_versions is not None and i < keep_versions:
+            continue
+        if keep_days is not None and row.created_at >= now - timedelta(days=keep_days):
+            continue
+        if row.archive_status == READY:
+            expired.append(row.version)
+    return expired
+
+
+def missing_archives(model):
+    """versions whose archives are supposedly ready but aren't in storage"""
+    storage = current_app.archive_storage
+    missing = []
+    for row in model.published:
+        if row.archive_status != READY or row.manifest is not None:
+            continue
+        archive_key = '{}/{}'.format(model.archive_prefix, row.archive_path)
+        keys = [archive_key] + [archives.variant_path(archive_key, encoding)
+                                for encoding in row.encodings or {}]
+        if not all(storage.exists(key) for key in keys):
+            missing.append(row.version)
+    return missing
+
+
+def stale_builds(model, now, timeout):
+    """versions whose archive builds have been pending for over `timeout`
+    seconds, so were lost to a crash or restart of their worker"""
+    stale = []
+    for row in model.published:
+        queued_at = row.queued_at or row.created_at
+        if row.archive_status == PENDING and queued_at < now - timedelta(seconds=timeout):
+            stale.append(row.version)
+    return stale
+
+
+def rebuild_archive(model, version):
+    """queues a version's archive for rebuilding and builds it.
+    returns False if the version was deleted in the meantime"""
+    model.lock()
+    row = model.version_row(version)
+    if row is None:
+        db.session.commit()
+        return False
+    row.queue_build()
+    db.session.commit()
+    current_app.archive_builder.build(model, version)
+    return True
+
+
+def prune_archive(model, version):
+    """prunes a version's archive, unless
+    the version was deleted in the meantime"""
+    try:
+        model.prune_archive(version)
+    except ModelNotFoundException:
+        pass
+    db.session.commit()
+
+
+def maintain(model, now=None, rebuild=False):
+    """runs the maintenance tasks for a model: repacking its repo,
+    pruning archives outside its retention policy and handling
+    missing archives and lost builds, which are rebuilt if `rebuild`
+    is set and otherwise pruned (so they're rebuilt when next requested).
+    returns a report of what was done"""
+    config = current_app.config
+    now = now or datetime.utcnow()
+    report = {'model': model.name}
+    if model.repo is None:
+        report['skipped'] = 'no repo'
+        return report
+
+    report['loose_objects'] = repack(model, config['REPACK_LOOSE_OBJECTS'])
+    report['repacked'] = report['loose_objects'] >= config['REPACK_LOOSE_OBJECTS']
+    db.session.commit()
+
+    report['pruned'] = expired_versions(model, now,
+                                        config['RETENTION_KEEP_VERSIONS'],
+                                        config['RETENTION_KEEP_DAYS'])
+    for version in report['pruned']:
+        prune_archive(model, version)
+
+    report['missing'] = missing_archives(model)
+    for version in report['missing']:
+        if rebuild:
+            rebuild_archive(model, version)
+        else:
+            prune_archive(model, version)
+
+    report['stale'] = stale_builds(model, now, config['ARCHIVE_BUILD_TIMEOUT'])
+    for version in report['stale']:
+        if rebuild:
+            rebuild_archive(model, version)
+        else:
+            prune_archive(model, version)
+
+    logger.info('Maintained {model}: {loose_objects} loose objects (repacked: {repacked}), '
+                'pruned {pruned}, missing {missing}, stale builds {stale}'.format(**report))
+    return report
@@ -0,0 +1,154 @@
+import os
+import time
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from flask import current_app, request, g
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the latency histograms' buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                    for k, v in labels)
+
+
+class Registry(object):
+    """thread-safe in-process counters and latency histograms,
+    rendered in the prometheus text format"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def inc(self, name, labels=None, value=1):
+        key = name, tuple(sorted((labels or {}).items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = name, tuple(sorted((labels or {}).items()))
+        with self.lock:
+            # bucket counts are cumulative
+            counts, total, count = self.histograms.get(key, ([0] * len(self.buckets), 0., 0))
+            counts = [c + 1 if value <= bound else c for c, bound in zip(counts, self.buckets)]
+            self.histograms[key] = counts, total + value, count + 1
+
+    def render(self, gauges=None):
+        """the registry's metrics (and any extra gauges,
+        as {name: {labels tuple: value}}) in the prometheus text format"""
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append('# HELP {} {}'.format(name, self.help.get(name, name)))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (n, labels), (counts, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bucket_count, bound in zip(counts, self.buckets):
+                    lines.append('{}_bucket{{{}}} {}'.format(
+                        name, _labels(labels + (('le', bound),)), bucket_count))
+                lines.append('{}_bucket{{{}}} {}'.format(name, _labels(labels + (('le', '+Inf'),)), count))
+                lines.append('{}_sum{{{}}} {}'.format(name, _labels(labels), total))
+                lines.append('{}_count{{{}}} {}'.format(name, _labels(labels), count))
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append('# HELP {} {}'.format(name, self.help.get(name, name)))
+            lines.append('# TYPE {} counter'.format(name))
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append('{}{{{}}} {}'.format(name, _labels(labels), value))
+
+        for name, values in sorted((gauges or {}).items()):
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in sorted(values.items()):
+                lines.append('{}{{{}}} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def timed(operation):
+    """records the latency of an internal operation
+    (e.g. `commit`, `archive_build`)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_app.metrics.observe('bk_operation_duration_seconds',
+                                    time.perf_counter() - start,
+                                    {'operation': operation})
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    g.response_status = None
+    g.profiler = None
+    if current_app.config['PROFILE_DIR'] is not None:
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:
+            # another request is being profiled (one profiler per process on newer pythons)
+            g.profiler = None
+
+
+def _after_request(resp):
+    g.response_status = resp.status_code
+    return resp
+
+
+def _teardown_request(exc):
+    # recorded on teardown, which (unlike after_request)
+    # also happens when a view raises
+    start = g.get('request_start')
+    if start is None:
+        return
+    g.request_start = None
+    profiler, g.profiler = g.get('profiler'), None
+    if profiler is not None:
+        profiler.disable()
+
+    duration = time.perf_counter() - start
+    status = g.response_status if exc is None and g.response_status is not None else 500
+    endpoint = request.endpoint or 'unknown'
+    registry = current_app.metrics
+    registry.observe('bk_request_duration_seconds', duration,
+                     {'endpoint': endpoint, 'method': request.method})
+    registry.inc('bk_requests_total',
+                 {'endpoint': endpoint, 'method': request.method, 'status': status})
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold is not None and duration >= threshold:
+        registry.inc('bk_slow_requests_total', {'endpoint': endpoint})
+        logger.warning('Slow request: {} {} took {:.3f}s'.format(request.method, request.path, duration))
+        if profiler is not None:
+            profile_path = os.path.join(current_app.config['PROFILE_DIR'], '{}-{}.prof'.format(
+                endpoint, int(time.time() * 1000)))
+            profiler.dump_stats(profile_path)
+
+
+def init_app(app):
+    """sets up the app's metrics registry and request instrumentation"""
+    app.metrics = Registry()
+    app.metrics.describe('bk_request_duration_seconds', 'Request latency per endpoint')
+    app.metrics.describe('bk_requests_total', 'Requests per endpoint and status')
+    app.metrics.describe('bk_operation_duration_seconds', 'Latency of internal operations')
+    app.metrics.describe('bk_slow_requests_total', 'Requests slower than SLOW_REQUEST_THRESHOLD')
+    if app.config['PROFILE_DIR'] is not None and not os.path.exists(app.config['PROFILE_DIR']):
+        os.makedirs(app.config['PROFILE_DIR'])
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -1,2 +1,5 @@
 from .model import Model
+from .version import ModelVersion
+from .change import ModelChange
+from .chunk import Chunk
 from .user import User, Role
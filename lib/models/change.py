@@ -0,0 +1,36 @@
+from lib.db import db
+from datetime import datetime
+
+# kinds of changes
+REGISTER = 'register'
+PUBLISH = 'publish'
+DELETE = 'delete'
+DESTROY = 'destroy'
+OWNER = 'owner'
+
+
+class ModelChange(db.Model):
+    """an entry of the append-only change log mirrors sync from.
+    ids are allocated in commit order (see `lib.locks.lock_changes`),
+    so they can be used as cursors"""
+    __tablename__   = 'model_change'
+    id              = db.Column(db.Integer(), primary_key=True)
+    model_id        = db.Column(db.Integer(), db.ForeignKey('model.id', ondelete='SET NULL'))
+    model_name      = db.Column(db.Unicode(255))
+    version         = db.Column(db.Unicode(255))
+    action          = db.Column(db.String(16))
+    created_at      = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __init__(self, model_name, action, version=None):
+        self.model_name = model_name
+        self.action = action
+        self.version = version
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'model': self.model_name,
+            'version': self.version,
+            'action': self.action,
+            'created_at': self.created_at.isoformat()
+        }
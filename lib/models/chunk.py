@@ -0,0 +1,10 @@
+from lib.db import db
+
+
+class Chunk(db.Model):
+    """a content-addressed piece of one or more archives,
+    counting the archive manifests referencing it"""
+    __tablename__   = 'chunk'
+    sha256          = db.Column(db.String(64), primary_key=True)
+    size            = db.Column(db.BigInteger())
+    refs            = db.Column(db.Integer(), default=0)
@@ -1,23 +1,66 @@
+import os
 import json
 import shutil
+import tempfile
 from lib.db import db
+from lib import archives, arrays, chunks, layout, locks, metrics, replicas, versions
+from lib.storage import delete_on_commit
 from git import Repo, Actor
 from datetime import datetime
 from flask import current_app
 from flask_sqlalchemy import BaseQuery
-from os import path, makedirs, remove
-from distutils.version import LooseVersion
-from sqlalchemy_searchable import SearchQueryMixin
-from sqlalchemy_utils.types import TSVectorType
-from lib.excs import ModelNotFoundException, ModelConflictException
+from os import path
+from sqlalchemy.dialects.postgresql import REAL
+from sqlalchemy_searchable import SearchQueryMixin, parse_search_query
+from sqlalchemy_utils.types import TSVectorType, JSONType
+from lib.excs import ModelNotFoundException, ModelConflictException, \
+    ArchivePendingException, ArchiveFailedException, ArchivePrunedException, \
+    InvalidVersionException
+from .version import ModelVersion, PENDING, READY, FAILED, PRUNED
+from .change import ModelChange, REGISTER, PUBLISH, DELETE, DESTROY
+
+# meta fields copied onto the model row,
+# so that listings don't need to read the repo
+SUMMARY_FIELDS = ['description', 'author', 'license', 'tags']
+
+# the file a model's payload is stored as, per format
+PAYLOAD_FILES = {
+    'json': 'model.json',
+    'binary': arrays.FILENAME
+}
 
 
 class ModelQuery(BaseQuery, SearchQueryMixin):
-    pass
+    def search_page(self, search_query, after=None, limit=50):
+        """full-text search ranked by relevance, then by id.
+        pages are keyset paginated: `after` is the (rank, id) of the
+        previous page's last result. returns (model, rank) pairs"""
+        parsed = parse_search_query(search_query)
+        if parsed:
+            rank = db.func.ts_rank_cd(Model.search_vector, db.func.to_tsquery(parsed))
+        else:
+            # no terms, so all models match equally
+            rank = db.cast(0, REAL)
+        query = self.search(search_query)
+        if after is not None:
+            # ranks are compared as reals, like ts_rank_cd computes them
+            after_rank, after_id = db.cast(after[0], REAL), after[1]
+            query = query.filter(db.or_(rank < after_rank,
+                                        db.and_(rank == after_rank, Model.id > after_id)))
+        return query.add_columns(rank).order_by(rank.desc(), Model.id).limit(limit).all()
+
+
+def close_repo(entry):
+    """closes a repo evicted from the repo cache,
+    ending its persistent git processes"""
+    entry[0].git.clear_cache()
 
 
 class Model(db.Model):
     __tablename__   = 'model'
+    # prefix matches (autocomplete) on names use this index
+    __table_args__  = (db.Index('ix_model_name_prefix', 'name',
+                                postgresql_ops={'name': 'text_pattern_ops'}),)
     query_class     = ModelQuery
     id              = db.Column(db.Integer(), primary_key=True)
     name            = db.Column(db.Unicode(255), unique=True)
@@ -27,17 +70,40 @@ class Model(db.Model):
     created_at      = db.Column(db.DateTime(), default=datetime.utcnow)
     updated_at      = db.Column(db.DateTime(), default=datetime.utcnow)
     search_vector   = db.Column(TSVectorType('name', 'description'))
+    latest_version  = db.Column(db.Unicode(255))
+    latest_sha      = db.Column(db.String(40))
+    latest_size     = db.Column(db.BigInteger())
+    summary         = db.Column(JSONType())
+    # retention policy of the model's archives, see `lib.maintenance`
+    keep_versions   = db.Column(db.Integer())
+    keep_days       = db.Column(db.Integer())
+    published       = db.relationship('ModelVersion', backref='model',
+                            order_by='ModelVersion.sort_key',
+                            cascade='all, delete-orphan')
+    # written to, never read through the model
+    changes         = db.relationship('ModelChange', lazy='noload')
 
     def __init__(self, name):
         self.name = name
 
+    def resolve_path(self, root):
+        """the model's directory under a storage root. resolving it may
+        stat the directories (while migrating layouts), so it's done
+        once per instance, and again once the model is locked"""
+        paths = getattr(self, '_paths', None)
+        if paths is None:
+            paths = self._paths = {}
+        if root not in paths:
+            paths[root] = layout.resolve(root, self.name, current_app.config)
+        return paths[root]
+
     @property
     def repo_path(self):
-        return path.join(current_app.config['REPO_DIR'], self.name)
+        return self.resolve_path(current_app.config['REPO_DIR'])
 
     @property
     def archive_path(self):
-        return path.join(current_app.config['ARCHIVE_DIR'], self.name)
+        return self.resolve_path(current_app.config['ARCHIVE_DIR'])
 
     @property
     def meta_path(self):
@@ -49,91 +115,439 @@ class Model(db.Model):
 
     @property
     def repo(self):
-        return Repo(self.repo_path) if path.exists(self.repo_path) else None
+        """the model's repo, opened through the per-thread repo cache.
+        a cached repo is reopened if its directory was replaced since
+        (e.g. the model was destroyed and re-registered by another process)"""
+        cache = current_app.repo_cache
+        try:
+            inode = os.stat(self.repo_path).st_ino
+        except OSError:
+            cache.invalidate(self.repo_path)
+            return None
+        entry = cache.get(self.repo_path)
+        if entry is not None and entry[1] == inode:
+            return entry[0]
+        with metrics.timed('repo_open'):
+            repo = Repo(self.repo_path)
+        cache.set(self.repo_path, (repo, inode))
+        return repo
 
-    def register(self, user):
-        """registers the model to the specified user"""
-        self.owner = user
+    def register(self, user=None):
+        """registers the model to the specified user
+        (or to the user already set as `owner_id`)"""
+        if user is not None:
+            self.owner = user
         if self.repo is None:
             self.make_repo()
+        self.log_change(REGISTER)
 
-    def archive(self, version=None):
-        """returns path for a specific version's archive.
-        if version is None, returns latest version"""
-        if self.repo is None:
-            raise ModelNotFoundException
+    def log_change(self, action, version=None):
+        """appends a change of the model to the change log"""
+        locks.lock_changes()
+        replicas.wrote(db.session, self.name)
+        self.changes.append(ModelChange(self.name, action, version))
+        current_app.search_cache.clear()
+
+    @property
+    def archive_prefix(self):
+        """storage key prefix of the model's archives"""
+        if not current_app.archive_storage.local:
+            return layout.key(self.name, current_app.config)
+        rel_path = path.relpath(self.archive_path, current_app.config['ARCHIVE_DIR'])
+        return rel_path.replace(path.sep, '/')
+
+    def archive(self, version=None, encoding=None):
+        """returns path for a specific version's archive,
+        or None if archives aren't stored on the local filesystem.
+        chunked archives are assembled, and returned as an open file.
+        if version is None, returns latest version.
+        if encoding is given, returns the path of the precompressed variant"""
+        archive_key = self.archive_key(version, encoding)
+        if archive_key is None:
+            # chunked archives are assembled on the local filesystem
+            row = self.version_row(version or self.latest)
+            return chunks.assemble(row.manifest, row.sha256)
+        return current_app.archive_storage.local_path(archive_key)
 
+    def archive_key(self, version=None, encoding=None):
+        """returns the storage key for a specific version's archive,
+        or None if it's stored as chunks.
+        if version is None, returns latest version.
+        if encoding is given, returns the key of the precompressed variant"""
         if version is None:
             version = self.latest
-        if version not in self.versions:
+        row = self.version_row(version)
+        if row is None:
             raise ModelNotFoundException
-        return path.join(self.archive_path, '{}.tar'.format(version))
+        if row.archive_status == PENDING:
+            raise ArchivePendingException
+        if row.archive_status == PRUNED:
+            raise ArchivePrunedException
+        if row.archive_status == FAILED or row.archive_path is None:
+            raise ArchiveFailedException
+        if encoding is not None and encoding not in (row.encodings or {}):
+            raise ModelNotFoundException
+        if row.manifest is not None:
+            return None
+        return archives.variant_path('{}/{}'.format(self.archive_prefix, row.archive_path), encoding)
 
     def make_repo(self):
         """creates a new git repo for the model,
         if it doesn't already exist"""
         if path.exists(self.repo_path):
             raise ModelConflictException
-        Repo.init(self.repo_path)
+        repo = Repo.init(self.repo_path)
+        current_app.repo_cache.set(self.repo_path, (repo, os.stat(self.repo_path).st_ino))
 
     @property
     def latest(self):
         """returns the latest version"""
-        if not self.versions:
-            return None
-        return self.versions[-1]
+        return self.latest_version
+
+    def lock(self):
+        """locks the model against concurrent writes until the end
+        of the transaction, and reloads it to see earlier writes"""
+        replicas.wrote(db.session, self.name)
+        db.session.flush()
+        with metrics.timed('lock_wait'):
+            locks.lock_model(self.id)
+        db.session.expire_all()
+        self._version_index = None
+        # the model's directories may have moved (see `layout.migrate`)
+        self._paths = None
+
+    def refresh_latest(self):
+        """copies the latest version's details onto the model row"""
+        # the published versions changed
+        self._version_index = None
+        row = max(self.published, key=lambda row: row.sort_key, default=None)
+        self.latest_version = row.version if row is not None else None
+        self.latest_sha = row.sha if row is not None else None
+        self.latest_size = row.size if row is not None else None
+        self.summary = row.summary if row is not None else None
 
     @property
     def versions(self):
-        """all available versions"""
-        repo = self.repo
-        if repo is None or not repo.tags:
-            return []
-        return [tag.name for tag in repo.tags]
+        """all available versions, oldest first"""
+        return self.version_index.versions
+
+    @property
+    def version_index(self):
+        """the model's versions sorted by their
+        (precomputed) sort keys, built once per instance"""
+        index = getattr(self, '_version_index', None)
+        if index is None:
+            index = versions.VersionIndex((row.sort_key, row.version) for row in self.published)
+            self._version_index = index
+        return index
+
+    @property
+    def published_loaded(self):
+        """whether the published versions are loaded (e.g. joined in
+        by the query, or being changed), so lookups needn't query them"""
+        return 'published' in self.__dict__
 
-    def publish(self, meta_data, model_data, version):
-        """updates a repo for the model (publishes a new version)"""
+    def resolve(self, constraint):
+        """returns the newest version satisfying the constraint, or None"""
+        if self.published_loaded:
+            return self.version_index.resolve(constraint)
+        query = db.session.query(ModelVersion.version).filter(ModelVersion.model_id == self.id)
+        for op, key in versions.parse_constraint(constraint):
+            query = query.filter(op(ModelVersion.sort_key, key))
+        row = query.order_by(ModelVersion.sort_key.desc()).first()
+        return row.version if row is not None else None
+
+    def version_row(self, version):
+        """returns the index row for a specific version, if it exists"""
+        if self.published_loaded:
+            for row in self.published:
+                if row.version == version:
+                    return row
+            return None
+        return ModelVersion.query.filter_by(model_id=self.id, version=version).first()
+
+    def check_version(self, version):
+        """checks that a version can be published,
+        i.e. that it is newer than the latest version"""
+        try:
+            key = versions.sort_key(version)
+        except ValueError as e:
+            raise InvalidVersionException(str(e))
+        # compared by the stored key, which legacy versions too
+        # long for the current format keep (see `versions.pad`)
+        latest = self.version_row(self.latest) if self.latest is not None else None
+        if latest is not None and latest.sort_key >= key:
+            raise ModelConflictException('Published version must be newer than {}'.format(self.latest))
+
+    def publish(self, meta_data, model_data, version, model_file=None, payload_format='json'):
+        """updates a repo for the model (publishes a new version).
+        instead of `model_data`, a path to an already serialized
+        model file can be passed as `model_file`; it is moved into the repo.
+        `payload_format` is the format of the model file (see `PAYLOAD_FILES`)"""
+        # the new version must be the newest,
+        # checked again by concurrent publishes once they get the lock
+        self.lock()
         repo = self.repo
         if repo is None:
             raise ModelNotFoundException
-
-        # the new version must be the newest
-        if self.latest is not None and LooseVersion(self.latest) >= LooseVersion(version):
-            raise ModelConflictException('Published version must be newer than {}'.format(self.latest))
+        self.check_version(version)
 
         with open(self.meta_path, 'w') as f:
             json.dump(meta_data, f)
 
         # TODO this should be PMML or something
-        with open(self.model_path, 'w') as f:
-            json.dump(model_data, f)
+        payload_file = PAYLOAD_FILES[payload_format]
+        if model_file is not None:
+            shutil.move(model_file, path.join(self.repo_path, payload_file))
+        else:
+            with open(self.model_path, 'w') as f:
+                json.dump(model_data, f)
+
+        # drop payloads in other formats left over from previous versions
+        stale = [f for f in PAYLOAD_FILES.values()
+                 if f != payload_file and path.exists(path.join(self.repo_path, f))]
+        if stale:
+            repo.index.remove(stale, working_tree=True)
 
-        repo.index.add(['*'])
         author = Actor(self.owner.name, self.owner.email)
-        repo.index.commit(version, author=author, committer=author)
-        repo.create_tag(version)
+        with metrics.timed('commit'):
+            repo.index.add(['*'])
+            commit = repo.index.commit(version, author=author, committer=author)
+        with metrics.timed('tag'):
+            repo.create_tag(version)
+        row = ModelVersion(version, sha=commit.hexsha)
+        row.summary = summarize(meta_data)
+        row.payload_format = payload_format
+        self.published.append(row)
+        self.refresh_latest()
         self.description = meta_data.get('description', '')
         self.updated_at = datetime.utcnow()
+        self.log_change(PUBLISH, version)
 
     def make_archive(self, version):
         """creates a tar archive for a specific version of the model"""
-        if not path.exists(self.archive_path):
-            makedirs(self.archive_path)
-        self.repo.archive(open(self.archive(version), 'wb'), version)
+        row = self.version_row(version)
+        if row is None:
+            raise ModelNotFoundException
+
+        # build the archive and its variants in a local scratch dir,
+        # then move them into storage
+        storage = current_app.archive_storage
+        archive_name = '{}.tar'.format(version)
+        archive_key = '{}/{}'.format(self.archive_prefix, archive_name)
+        with metrics.timed('archive_build'):
+            scratch_dir = tempfile.mkdtemp(prefix='.build-', dir=current_app.config['ARCHIVE_DIR'])
+            try:
+                archive_path = path.join(scratch_dir, archive_name)
+                with open(archive_path, 'wb') as f:
+                    self.repo.archive(f, version)
+                sha256 = archives.digest(archive_path)
+                size = path.getsize(archive_path)
+
+                if current_app.config['ARCHIVE_CHUNKING']:
+                    # stored as chunks shared between versions,
+                    # so there are no precompressed variants. chunk rows
+                    # are always locked after their model's lock (as when
+                    # a version is deleted), so take it first
+                    self.lock()
+                    if self.version_row(version) is None:
+                        return
+                    manifest = chunks.store(archive_path, scratch_dir)
+                    encodings = {}
+                else:
+                    manifest = None
+                    encodings = archives.compress(archive_path)
+                    for encoding in encodings:
+                        storage.put(archives.variant_path(archive_key, encoding),
+                                    archives.variant_path(archive_path, encoding),
+                                    content_type='application/x-tar',
+                                    content_encoding=encoding)
+                    storage.put(archive_key, archive_path, content_type='application/x-tar')
+            finally:
+                shutil.rmtree(scratch_dir)
+
+        # otherwise only the bookkeeping is done under the lock, so
+        # builds don't hold up publishes. the version may be gone by now
+        self.lock()
+        row = self.version_row(version)
+        if row is None:
+            if manifest is not None:
+                chunks.release(manifest)
+            else:
+                for encoding in encodings:
+                    storage.delete(archives.variant_path(archive_key, encoding))
+                storage.delete(archive_key)
+            return
+
+        # a rebuilt archive no longer references its previous chunks
+        if row.manifest is not None:
+            chunks.release(row.manifest)
+        row.manifest = manifest
+        row.encodings = encodings
+        row.sha256 = sha256
+        row.archive_path = archive_name
+        row.size = size
+        row.archive_status = READY
+        self.refresh_latest()
 
     def delete(self, version):
         """deletes a specific version"""
-        if version not in self.versions:
+        self.lock()
+        row = self.version_row(version)
+        if row is None:
             raise ModelNotFoundException
-        remove(self.archive(version))
-        self.repo.delete_tag(version)
+        self._remove_archive(row)
+        with metrics.timed('tag'):
+            self.repo.delete_tag(version)
+        self.published.remove(row)
+        self.refresh_latest()
+        self.log_change(DELETE, version)
+
+    def _remove_archive(self, row):
+        """removes a version's archive (and its variants) from storage,
+        once the transaction commits"""
+        if row.manifest is not None:
+            chunks.release(row.manifest)
+        elif row.archive_path is not None:
+            archive_key = '{}/{}'.format(self.archive_prefix, row.archive_path)
+            for encoding in row.encodings or {}:
+                delete_on_commit(db.session, archives.variant_path(archive_key, encoding))
+            delete_on_commit(db.session, archive_key)
+
+    def prune_archive(self, version):
+        """removes a version's archive to free up space, keeping the
+        version. the archive is rebuilt from its tag when requested"""
+        self.lock()
+        row = self.version_row(version)
+        if row is None:
+            raise ModelNotFoundException
+        self._remove_archive(row)
+        row.manifest = None
+        row.encodings = None
+        row.archive_path = None
+        row.archive_status = PRUNED
+
+    def restore_archive(self, version):
+        """queues a pruned archive for rebuilding. returns False
+        if it isn't pruned (e.g. it's already being rebuilt)"""
+        self.lock()
+        row = self.version_row(version)
+        if row is None or row.archive_status != PRUNED:
+            return False
+        row.queue_build()
+        return True
 
     def destroy(self):
         """destroys the entire package"""
+        self.lock()
+        current_app.repo_cache.invalidate(self.repo_path)
         shutil.rmtree(self.repo_path)
-        shutil.rmtree(self.archive_path)
+        delete_on_commit(db.session, self.archive_prefix, prefix=True)
+        for row in self.published:
+            if row.manifest is not None:
+                chunks.release(row.manifest)
+        del self.published[:]
+        self.refresh_latest()
+        self.log_change(DESTROY)
+
+    def reindex(self):
+        """rebuilds the version index from the repo's tags
+        and any existing archives. returns the tags which
+        can't be indexed, as they're not valid versions"""
+        repo = self.repo
+        if repo is None:
+            raise ModelNotFoundException
+
+        storage = current_app.archive_storage
+        stale = {row.version: row for row in self.published}
+        with metrics.timed('tag_list'):
+            tags = repo.tags
+        skipped = []
+        for tag in tags:
+            row = stale.pop(tag.name, None)
+            if row is None:
+                try:
+                    row = ModelVersion(tag.name)
+                except ValueError:
+                    skipped.append(tag.name)
+                    continue
+                row.created_at = datetime.utcfromtimestamp(tag.commit.committed_date)
+                self.published.append(row)
+            row.sha = tag.commit.hexsha
+            row.payload_format = 'binary' if arrays.FILENAME in tag.commit.tree else 'json'
+            if row.summary is None:
+                meta_blob = tag.commit.tree / 'meta.json'
+                row.summary = summarize(json.loads(meta_blob.data_stream.read().decode('utf-8')))
+
+            if row.manifest is not None:
+                # chunked archives are only known by their manifests
+                continue
+
+            archive_name = '{}.tar'.format(tag.name)
+            archive_key = '{}/{}'.format(self.archive_prefix, archive_name)
+            if storage.exists(archive_key):
+                encodings = {}
+                for encoding, _, _ in archives.COMPRESSORS:
+                    variant_key = archives.variant_path(archive_key, encoding)
+                    if storage.exists(variant_key):
+                        encodings[encoding] = archives.digest(storage.open(variant_key))
+                row.encodings = encodings
+                row.sha256 = archives.digest(storage.open(archive_key))
+                row.archive_path = archive_name
+                row.size = storage.size(archive_key)
+                row.archive_status = READY
+            else:
+                row.archive_path = None
+                row.size = None
+                row.archive_status = FAILED
+
+        # drop rows for tags that no longer exist
+        for row in stale.values():
+            self.published.remove(row)
+        self.refresh_latest()
+        return skipped
+
+    def version_meta(self, version, sha=None):
+        """metadata of a specific version, read from the version's commit
+        (`sha`, looked up if not given). it's cached per commit, so a
+        version that's deleted and republished is never served stale"""
+        if sha is None:
+            row = self.version_row(version)
+            if row is None:
+                raise ModelNotFoundException
+            sha = row.sha
+        meta = current_app.meta_cache.get(sha)
+        if meta is None:
+            with metrics.timed('meta_read'):
+                try:
+                    blob = self.repo.commit(sha).tree / 'meta.json'
+                except (KeyError, ValueError):
+                    raise ModelNotFoundException
+                meta = json.loads(blob.data_stream.read().decode('utf-8'))
+            current_app.meta_cache.set(sha, meta)
+        return meta
+
+    def version_blob(self, version, filename):
+        """git blob of a file as of a specific version"""
+        if self.version_row(version) is None:
+            raise ModelNotFoundException
+        try:
+            return self.repo.commit(version).tree / filename
+        except KeyError:
+            raise ModelNotFoundException
+
+    def version_file(self, version, filename):
+        """contents of a file as of a specific version"""
+        return self.version_blob(version, filename).data_stream.read()
 
     @property
     def meta(self):
-        """model metadata"""
-        return json.load(open(self.meta_path, 'r'))
+        """model metadata (of the latest version)"""
+        if self.latest is None:
+            raise ModelNotFoundException
+        return self.version_meta(self.latest, self.latest_sha)
+
+
+def summarize(meta_data):
+    """picks out the summary fields of a model's metadata"""
+    return {k: meta_data[k] for k in SUMMARY_FIELDS if k in meta_data}
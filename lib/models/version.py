@@ -0,0 +1,52 @@
+import uuid
+from lib.db import db
+from datetime import datetime
+from sqlalchemy_utils.types import JSONType
+from lib.versions import sort_key
+
+# archive build statuses
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+# removed by the retention policy, rebuilt when downloaded
+PRUNED = 'pruned'
+
+
+class ModelVersion(db.Model):
+    __tablename__   = 'model_version'
+    __table_args__  = (db.UniqueConstraint('model_id', 'version'),
+                       db.Index('ix_model_version_sort_key', 'model_id', 'sort_key'))
+    id              = db.Column(db.Integer(), primary_key=True)
+    model_id        = db.Column(db.Integer(), db.ForeignKey('model.id'))
+    version         = db.Column(db.Unicode(255))
+    sort_key        = db.Column(db.Unicode())
+    sha             = db.Column(db.String(40))
+    archive_path    = db.Column(db.Unicode(255))
+    size            = db.Column(db.BigInteger())
+    sha256          = db.Column(db.String(64))
+    encodings       = db.Column(JSONType())
+    manifest        = db.Column(JSONType())
+    summary         = db.Column(JSONType())
+    payload_format  = db.Column(db.String(16), default='json')
+    build_id        = db.Column(db.String(32))
+    archive_status  = db.Column(db.String(16))
+    queued_at       = db.Column(db.DateTime())
+    created_at      = db.Column(db.DateTime(), default=datetime.utcnow)
+
+    def __init__(self, version, sha=None):
+        self.version = version
+        self.sort_key = sort_key(version)
+        self.sha = sha
+        self.queue_build()
+
+    def queue_build(self):
+        """marks the archive as (re)building, under a new build id"""
+        self.build_id = uuid.uuid4().hex
+        self.archive_status = PENDING
+        self.queued_at = datetime.utcnow()
+
+    def digest(self, encoding=None):
+        """content hash of the archive (or of one of its variants)"""
+        if encoding is None:
+            return self.sha256
+        return self.encodings[encoding]
@@ -0,0 +1,93 @@
+import re
+import json
+from lib.excs import PatchException
+
+
+def canonical(doc):
+    """canonical json serialization (sorted keys, no whitespace),
+    which patched models are checksummed and stored as"""
+    return json.dumps(doc, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def parse_pointer(pointer):
+    """splits a json pointer (RFC 6901) into its reference tokens"""
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchException('Invalid pointer: {}'.format(pointer))
+    return [t.replace('~1', '/').replace('~0', '~') for t in pointer[1:].split('/')]
+
+
+# array indices (RFC 6901), without signs or leading zeros
+INDEX = re.compile(r'^(0|[1-9][0-9]*)$')
+
+
+def parse_index(token, array):
+    """the index of an array a token refers to;
+    `-` refers past the last element"""
+    if token == '-':
+        return len(array)
+    if not INDEX.match(token):
+        raise ValueError(token)
+    return int(token)
+
+
+def resolve(doc, tokens):
+    """returns the container the last token refers into, and the last token"""
+    for token in tokens[:-1]:
+        try:
+            doc = doc[parse_index(token, doc)] if isinstance(doc, list) else doc[token]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchException('Invalid path: /{}'.format('/'.join(tokens)))
+    return doc, tokens[-1]
+
+
+def apply(doc, patch):
+    """applies a json patch (the add, remove and replace
+    operations of RFC 6902) to a document; returns the patched document"""
+    if not isinstance(patch, list):
+        raise PatchException('Patch must be a list of operations')
+    for op in patch:
+        try:
+            kind, tokens = op['op'], parse_pointer(op['path'])
+        except (KeyError, TypeError):
+            raise PatchException('Invalid operation: {}'.format(op))
+        if kind in ('add', 'replace') and 'value' not in op:
+            raise PatchException('Missing value: {} {}'.format(kind, op['path']))
+
+        if not tokens:
+            if kind not in ('add', 'replace'):
+                raise PatchException('Can\'t {} the whole document'.format(kind))
+            doc = op['value']
+            continue
+
+        parent, token = resolve(doc, tokens)
+        try:
+            if isinstance(parent, list):
+                index = parse_index(token, parent)
+                if kind == 'add':
+                    if index > len(parent):
+                        raise IndexError
+                    parent.insert(index, op['value'])
+                elif kind == 'replace':
+                    parent[index] = op['value']
+                elif kind == 'remove':
+                    del parent[index]
+                else:
+                    raise PatchException('Unsupported operation: {}'.format(kind))
+            elif isinstance(parent, dict):
+                if kind == 'add':
+                    parent[token] = op['value']
+                elif kind == 'replace':
+                    if token not in parent:
+                        raise KeyError(token)
+                    parent[token] = op['value']
+                elif kind == 'remove':
+                    del parent[token]
+                else:
+                    raise PatchException('Unsupported operation: {}'.format(kind))
+            else:
+                raise TypeError
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchException('Invalid path: {}'.format(op['path']))
+    return doc
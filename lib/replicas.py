@@ -0,0 +1,78 @@
+import random
+import sqlalchemy
+from functools import wraps
+from flask import current_app, request, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from lib import cache
+from lib.db import db, RoutingSession
+
+
+def init_app(app):
+    """sets up engines for the app's read replicas
+    (none if `SQLALCHEMY_REPLICA_URIS` is empty) and the
+    record of recently written models, which are read from the primary"""
+    app.replica_engines = []
+    for uri in app.config['SQLALCHEMY_REPLICA_URIS']:
+        info = make_url(uri)
+        options = {'convert_unicode': True}
+        for key in ['pool_size', 'max_overflow']:
+            value = app.config['SQLALCHEMY_REPLICA_{}'.format(key.upper())]
+            if value is not None:
+                options[key] = value
+        db.apply_driver_hacks(app, info, options)
+        app.replica_engines.append(sqlalchemy.create_engine(info, **options))
+    app.replica_sticky = cache.from_config(app.config, 'REPLICA_STICKY')
+
+
+def read_only(methods=('GET', 'HEAD')):
+    """routes the queries of a view's requests (with one of `methods`)
+    to a replica, unless the view's model (its `name` argument)
+    was written recently, so its writes are visible to the next reads"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            engines = current_app.replica_engines
+            name = kwargs.get('name')
+            if not engines or request.method not in methods \
+                    or (name is not None and current_app.replica_sticky.get(name)):
+                return f(*args, **kwargs)
+            g.replica = random.choice(engines)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                g.replica = None
+        return decorated
+    return decorator
+
+
+def use_primary():
+    """routes the rest of the request's queries to the primary,
+    e.g. once it writes"""
+    if has_app_context():
+        g.replica = None
+
+
+def wrote(session, name):
+    """records that the session writes to a model. once committed,
+    the model is read from the primary for `REPLICA_STICKY_CACHE_TTL` seconds"""
+    use_primary()
+    session.info.setdefault('written', set()).add(name)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    use_primary()
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    names = session.info.pop('written', ())
+    if names and session.app.replica_engines:
+        for name in names:
+            session.app.replica_sticky.set(name, True)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('written', None)
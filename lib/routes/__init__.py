@@ -1,9 +1,27 @@
 from .models import bp as models_bp
 from .users import bp as users_bp
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, render_template, jsonify, current_app
 
 bp = Blueprint('main', __name__)
 
 @bp.route('/')
 def index():
     return render_template('index.html')
+
+
+@bp.route('/stats')
+def stats():
+    return jsonify(repo_cache=current_app.repo_cache.stats,
+                   meta_cache=current_app.meta_cache.stats)
+
+
+@bp.route('/metrics')
+def metrics():
+    """request and operation metrics, plus cache stats,
+    in the prometheus text format"""
+    gauges = {}
+    for cache_name in ['repo_cache', 'token_cache', 'meta_cache', 'search_cache']:
+        for stat, value in getattr(current_app, cache_name).stats.items():
+            gauges.setdefault('bk_cache_{}'.format(stat), {})[(('cache', cache_name),)] = value
+    return Response(current_app.metrics.render(gauges),
+                    mimetype='text/plain; version=0.0.4')
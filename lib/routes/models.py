@@ -1,23 +1,187 @@
+import io
 import os
+import json
+import base64
+import binascii
+import hashlib
+import mimetypes
+from lib import auth, patch, arrays, uploads, archives, downloads, metrics, replicas
 from lib.db import db
-from lib.models import Model, User
-from lib.excs import ModelNotFoundException, ModelConflictException
-from flask import Blueprint, send_from_directory, jsonify, request, abort
+from lib.models import Model, ModelChange, User
+from lib.models.change import OWNER
+from lib.models.model import PAYLOAD_FILES
+from lib.excs import ModelNotFoundException, ModelConflictException, ChecksumMismatchException, \
+    ArchivePendingException, ArchiveFailedException, ArchivePrunedException, \
+    PatchException, PayloadException, InvalidVersionException
+from flask import Blueprint, jsonify, request, abort, redirect, current_app
 from flask_security import auth_token_required
-from flask_security.core import _token_loader
+from werkzeug.wsgi import LimitedStream
+from sqlalchemy.exc import IntegrityError
 
 bp = Blueprint('models', __name__, url_prefix='/models')
 
+# names of the blueprint's static routes, which
+# would shadow the routes of models named like them
+RESERVED_NAMES = ['batch', 'changes', 'complete', 'register', 'search']
+
 
 def validate_owner(model, request):
     """validates model ownership via auth token"""
-    auth_token = request.headers.get('Authentication-Token')
-    user = _token_loader(auth_token)
-    if model.owner != user:
+    user_id = auth.verify_token(request.headers.get('Authentication-Token'))
+    if user_id is None or model.owner_id != user_id:
         abort(401)
 
 
+def send_archive(model, version=None):
+    """sends a version's archive (the latest if version is None),
+    or asks the client to retry if it's still being built"""
+    try:
+        # pick a precompressed variant the client accepts
+        row = model.version_row(version or model.latest)
+        encodings = row.encodings if row is not None else None
+        encoding = archives.negotiate(request.accept_encodings, encodings or [])
+
+        archive_key = model.archive_key(version, encoding)
+        if archive_key is None:
+            # chunked archives are only assembled if they're sent
+            resp = downloads.not_modified(row.digest())
+            if resp is None:
+                resp = downloads.send_file(model.archive(version), row.digest(), 'application/x-tar')
+        else:
+            resp = send_stored(archive_key, row.digest(encoding), 'application/x-tar')
+        # a redirect's body isn't the variant; the
+        # storage serves that with its own encoding
+        if encoding is not None and resp.location is None:
+            resp.headers['Content-Encoding'] = encoding
+        resp.vary.add('Accept-Encoding')
+        return resp
+    except ModelNotFoundException:
+        abort(404)
+    except ArchivePrunedException:
+        return restore_archive(model, version or model.latest)
+    except (ArchivePendingException, ArchiveFailedException) as e:
+        return archive_unavailable(e)
+
+
+def restore_archive(model, version):
+    """queues the rebuild of a pruned archive (unless another
+    request already did), and asks the client to retry"""
+    if model.restore_archive(version):
+        db.session.add(model)
+        db.session.commit()
+        current_app.archive_builder.submit(model, version)
+    return archive_unavailable(ArchivePendingException())
+
+
+def send_stored(key, etag, mimetype):
+    """sends a blob from archive storage: as a file if it's stored locally,
+    otherwise as a redirect to the storage's url or streamed through"""
+    storage = current_app.archive_storage
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return downloads.send_file(local_path, etag, mimetype)
+
+    resp = downloads.not_modified(etag)
+    if resp is not None:
+        return resp
+    if current_app.config['ARCHIVE_REDIRECT']:
+        resp = redirect(storage.url(key, current_app.config['ARCHIVE_REDIRECT_EXPIRES']))
+        resp.set_etag(etag)
+        return resp
+    return downloads.send_stream(storage.open(key), storage.size(key), etag, mimetype)
+
+
+def archive_unavailable(e):
+    """response for an archive which is still being built, or failed to build"""
+    if isinstance(e, ArchivePendingException):
+        resp = jsonify(status='pending', reason='Archive is being built, retry later')
+        resp.status_code = 503
+        resp.headers['Retry-After'] = str(current_app.config['ARCHIVE_RETRY_AFTER'])
+        return resp
+    return jsonify(status='failure', reason='Archive build failed'), 500
+
+
+def send_meta(model, version, sha):
+    """sends a version's metadata, tagged with the version's commit"""
+    resp = downloads.not_modified(sha)
+    if resp is not None:
+        return resp
+
+    try:
+        resp = jsonify(**model.version_meta(version, sha))
+    except ModelNotFoundException:
+        abort(404)
+    resp.set_etag(sha)
+    return resp
+
+
+def publish_stream(model, request):
+    """publishes a model sent as the raw request body.
+    the metadata is sent as json in the `Model-Meta` header,
+    the body's sha256 hex digest in the `Model-SHA256` header
+    and its format (`json` or `binary`) in the `Model-Format` header.
+    returns the published version"""
+    try:
+        meta = json.loads(request.headers['Model-Meta'])
+        digest = request.headers['Model-SHA256']
+        version = meta['version']
+    except (KeyError, ValueError):
+        abort(400)
+    payload_format = request.headers.get('Model-Format', 'json')
+    if payload_format not in PAYLOAD_FILES:
+        abort(400)
+
+    # check the version before receiving the full model
+    model.check_version(version)
+
+    model_file = uploads.receive(request.stream,
+                                 current_app.config['REPO_DIR'],
+                                 digest,
+                                 current_app.config['UPLOAD_CHUNK_SIZE'])
+    try:
+        if payload_format == 'binary':
+            arrays.validate(model_file)
+        model.publish(meta, None, version, model_file=model_file, payload_format=payload_format)
+    finally:
+        if os.path.exists(model_file):
+            os.remove(model_file)
+    return version
+
+
+def publish_patch(model, data):
+    """publishes a model sent as a json patch (`patch`) against
+    the model of an existing version (`base`). `sha256` is the hex
+    digest of the patched model in its canonical serialization,
+    which is also how it's stored. returns the published version"""
+    meta = data.get('meta')
+    if not isinstance(meta, dict) or not isinstance(meta.get('version'), str):
+        raise PatchException('Missing meta.version')
+    for key in ['base', 'sha256']:
+        if not isinstance(data.get(key), str):
+            raise PatchException('Missing {}'.format(key))
+    version = meta['version']
+    model.check_version(version)
+
+    try:
+        base = json.loads(model.version_file(data['base'], 'model.json').decode('utf-8'))
+    except ModelNotFoundException:
+        raise PatchException('No model for base version {}'.format(data['base']))
+    model_data = patch.apply(base, data['patch'])
+
+    model_file = uploads.receive(io.BytesIO(patch.canonical(model_data)),
+                                 current_app.config['REPO_DIR'],
+                                 data['sha256'],
+                                 current_app.config['UPLOAD_CHUNK_SIZE'])
+    try:
+        model.publish(meta, None, version, model_file=model_file)
+    finally:
+        if os.path.exists(model_file):
+            os.remove(model_file)
+    return version
+
+
 @bp.route('/<name>', methods=['GET', 'POST', 'DELETE', 'PUT'])
+@replicas.read_only()
 def model(name):
     """variously manage or download models"""
     model = Model.query.filter_by(name=name).first_or_404()
@@ -27,46 +191,73 @@ def model(name):
         validate_owner(model, request)
 
         # TODO validate the data
-        # TODO should the model be sent as a separate file, w/ a checksum?
-        # TODO client should first validate version stuff before submitting the full model
-        data = request.get_json()
-
         try:
-            version = data['meta']['version']
-            model.publish(data['meta'], data['model'], version)
-            model.make_archive(version)
+            if request.mimetype == 'application/octet-stream':
+                version = publish_stream(model, request)
+            else:
+                data = request.get_json()
+                if 'patch' in data:
+                    version = publish_patch(model, data)
+                else:
+                    version = data['meta']['version']
+                    model.publish(data['meta'], data['model'], version)
             db.session.add(model)
             db.session.commit()
-            return jsonify(status='success')
+
+            # build the archive in the background
+            build_id = model.version_row(version).build_id
+            current_app.archive_builder.submit(model, version)
+            return jsonify(status='success', build=build_id)
         except ModelConflictException as e:
             return jsonify(status='failure', reason=str(e)), 409
+        except IntegrityError:
+            # lost a race for the version to a concurrent publish
+            db.session.rollback()
+            return jsonify(status='failure', reason='Version already published'), 409
+        except (ChecksumMismatchException, PatchException,
+                PayloadException, InvalidVersionException) as e:
+            return jsonify(status='failure', reason=str(e)), 400
 
     elif request.method == 'DELETE':
         # deletes the entire model package
         validate_owner(model, request)
         model.destroy()
+        db.session.add(model)
+        db.session.commit()
         return jsonify(status='success')
 
     elif request.method == 'PUT':
-        # this is just for changing ownership atm
+        # change ownership and/or the archive retention policy
         validate_owner(model, request)
         data = request.get_json()
 
-        user = User.query.filter_by(name=data['user']).first_or_404()
-        model.owner = user
+        if 'retention' in data:
+            retention = data['retention']
+            for key in ['keep_versions', 'keep_days']:
+                value = retention.get(key)
+                if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                    return jsonify(status='failure', reason='Invalid {}'.format(key)), 400
+                setattr(model, key, value)
+
+        previous_owner_id = None
+        if 'user' in data:
+            user = User.query.filter_by(name=data['user']).first_or_404()
+            previous_owner_id = model.owner_id
+            model.owner = user
+            model.log_change(OWNER)
         db.session.add(model)
         db.session.commit()
+        if previous_owner_id is not None:
+            auth.invalidate_user(previous_owner_id)
         return jsonify(status='success')
 
     else:
         # download archive
-        try:
-            return send_from_directory(*os.path.split(model.archive()))
-        except ModelNotFoundException:
-            abort(404)
+        return send_archive(model)
 
 
 @bp.route('/<name>/<version>', methods=['GET', 'DELETE'])
+@replicas.read_only()
 def model_version(name, version):
     """manage a specific version of a model package"""
     model = Model.query.filter_by(name=name).first_or_404()
@@ -76,22 +267,145 @@ def model_version(name, version):
         validate_owner(model, request)
         try:
             model.delete(version)
+            db.session.add(model)
+            db.session.commit()
             return jsonify(status='success')
         except ModelNotFoundException:
             abort(404)
     else:
         # download the version
-        try:
-            return send_from_directory(*os.path.split(model.archive(version)))
-        except ModelNotFoundException:
+        return send_archive(model, version)
+
+
+@bp.route('/<name>/resolve')
+@replicas.read_only()
+def model_resolve(name):
+    """resolve a version constraint (e.g. `>=1.2,<2` or `~1.4`)
+    to the newest matching version"""
+    model = Model.query.filter_by(name=name).first_or_404()
+    constraint = request.args.get('constraint')
+    if not constraint:
+        abort(400)
+    try:
+        version = model.resolve(constraint)
+    except ValueError as e:
+        return jsonify(status='failure', reason=str(e)), 400
+    if version is None:
+        abort(404)
+    return jsonify(version=version)
+
+
+@bp.route('/<name>/<version>/status')
+@replicas.read_only()
+def model_version_status(name, version):
+    """archive build status of a specific version"""
+    model = Model.query.filter_by(name=name).first_or_404()
+    row = model.version_row(version)
+    if row is None:
+        abort(404)
+    return jsonify(version=row.version, build=row.build_id, status=row.archive_status)
+
+
+@bp.route('/<name>/<version>/arrays/<array>')
+@replicas.read_only()
+def model_version_array(name, version, array):
+    """download a single array of a version's binary payload,
+    straight from the version's archive"""
+    model = Model.query.filter_by(name=name).first_or_404()
+    row = model.version_row(version)
+    if row is None or row.payload_format != 'binary':
+        abort(404)
+
+    try:
+        model.archive_key(version)
+    except ArchivePrunedException:
+        return restore_archive(model, version)
+    except (ArchivePendingException, ArchiveFailedException) as e:
+        return archive_unavailable(e)
+
+    # the payload's sha256 is only known once its archive is built
+    etag = hashlib.sha256('{}/{}'.format(row.sha256, array).encode('utf-8')).hexdigest()
+    resp = downloads.not_modified(etag)
+    if resp is not None:
+        return resp
+
+    archive_path = model.archive(version)
+    if archive_path is not None:
+        desc, offset = arrays.locate(archive_path, array)
+        if desc is None:
+            abort(404)
+        resp = downloads.send_file(archive_path, etag, 'application/octet-stream',
+                                   offset=offset, length=desc['nbytes'])
+    else:
+        # archives aren't stored locally, read the array from git
+        stream = model.version_blob(version, arrays.FILENAME).data_stream
+        desc = arrays.seek_array(stream, array)
+        if desc is None:
             abort(404)
+        resp = downloads.send_stream(LimitedStream(stream, desc['nbytes']), desc['nbytes'],
+                                     etag, 'application/octet-stream')
+    resp.headers['Array-Dtype'] = desc['dtype']
+    resp.headers['Array-Shape'] = ','.join(str(d) for d in desc['shape'])
+    return resp
+
+
+@bp.route('/<name>/<version>/files/<path:filename>')
+@replicas.read_only()
+def model_version_file(name, version, filename):
+    """download a single file of a specific version, from the
+    version's archive or, while that's unavailable, from git"""
+    model = Model.query.filter_by(name=name).first_or_404()
+    row = model.version_row(version)
+    if row is None:
+        abort(404)
+
+    # a file's contents are identified by the commit and its path
+    etag = hashlib.sha256('{}/{}'.format(row.sha, filename).encode('utf-8')).hexdigest()
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    resp = downloads.not_modified(etag)
+    if resp is not None:
+        return resp
+
+    try:
+        archive_path = model.archive(version)
+    except (ArchivePendingException, ArchiveFailedException, ArchivePrunedException):
+        archive_path = None
+
+    if archive_path is not None:
+        window = archives.member_window(archive_path, filename)
+        if window is None:
+            abort(404)
+        offset, length = window
+        return downloads.send_file(archive_path, etag, mimetype, offset=offset, length=length)
+
+    try:
+        blob = model.version_blob(version, filename)
+    except ModelNotFoundException:
+        abort(404)
+    if blob.type != 'blob':
+        abort(404)
+    return downloads.send_stream(blob.data_stream, blob.size, etag, mimetype)
 
 
 @bp.route('/<name>.json')
+@replicas.read_only()
 def model_json(name):
     """return model json metadata"""
     model = Model.query.filter_by(name=name).first_or_404()
-    return jsonify(**model.meta)
+    if model.latest is None:
+        abort(404)
+    return send_meta(model, model.latest, model.latest_sha)
+
+
+@bp.route('/<name>/<version>.json')
+@replicas.read_only()
+def model_version_json(name, version):
+    """return json metadata of a specific version"""
+    model = Model.query.filter_by(name=name).first_or_404()
+    row = model.version_row(version)
+    if row is None:
+        abort(404)
+    return send_meta(model, version, row.sha)
 
 
 @bp.route('/register', methods=['POST'])
@@ -99,13 +413,15 @@ def model_json(name):
 def register():
     """register a model"""
     data = request.get_json()
-
-    # authenticate the user
     name = data['name']
+    if not name or name.startswith('.') or name in RESERVED_NAMES:
+        # names starting with a dot are reserved for the server's
+        # own directories under REPO_DIR and ARCHIVE_DIR (e.g. `.chunks`, `.shards`)
+        return jsonify(status='failure', reason='Invalid model name'), 400
 
-    auth_token = request.headers.get('Authentication-Token')
-    user = _token_loader(auth_token)
-    if not user.is_authenticated:
+    # authenticate the user
+    user_id = auth.verify_token(request.headers.get('Authentication-Token'))
+    if user_id is None:
         abort(401)
 
     # confirm no conflicts
@@ -114,21 +430,155 @@ def register():
         abort(409)
 
     model = Model(name)
-    model.register(user)
+    model.owner_id = user_id
+    model.register()
     db.session.add(model)
     db.session.commit()
     return jsonify(status='success')
 
 
+@bp.route('/changes')
+@replicas.read_only()
+def changes():
+    """the change log, for mirrors to sync incrementally.
+    pass the `next` cursor of a page as `since` to get the changes after it"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', current_app.config['CHANGES_PAGE_SIZE'])),
+                    current_app.config['CHANGES_PAGE_SIZE'])
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+
+    page = ModelChange.query.filter(ModelChange.id > since) \
+        .order_by(ModelChange.id).limit(limit).all()
+    return jsonify(changes=[change.to_dict() for change in page],
+                   next=page[-1].id if page else since)
+
+
+@bp.route('/batch', methods=['POST'])
+@replicas.read_only(methods=['POST'])
+def batch():
+    """resolve the versions and metadata of many models at once.
+    `models` is either a list of names, or a mapping of
+    names to version constraints (null for the latest version)"""
+    data = request.get_json(silent=True)
+    requested = data.get('models') if isinstance(data, dict) else None
+    if isinstance(requested, list):
+        if not all(isinstance(name, str) for name in requested):
+            return jsonify(status='failure', reason='Model names must be strings'), 400
+        requested = dict.fromkeys(requested)
+    if not isinstance(requested, dict):
+        return jsonify(status='failure',
+                       reason='Expected `models`, a list of names or a mapping of names to version constraints'), 400
+    for name, constraint in requested.items():
+        if constraint is not None and not isinstance(constraint, str):
+            return jsonify(status='failure', reason='Invalid version constraint for {}'.format(name)), 400
+    if len(requested) > current_app.config['BATCH_MAX_MODELS']:
+        return jsonify(status='failure',
+                       reason='At most {} models per batch'.format(current_app.config['BATCH_MAX_MODELS'])), 400
+
+    results = {}
+    if requested:
+        models = Model.query.filter(Model.name.in_(list(requested))) \
+                            .options(db.joinedload(Model.published))
+        for model in models:
+            constraint = requested[model.name]
+            try:
+                if constraint is None:
+                    version = model.latest
+                else:
+                    version = model.resolve(constraint)
+            except ValueError as e:
+                return jsonify(status='failure', reason=str(e)), 400
+            if version is not None:
+                results[model.name] = {
+                    'version': version,
+                    'meta': model.version_meta(version)
+                }
+    return jsonify(results=results, missing=sorted(set(requested) - set(results)))
+
+
+def encode_cursor(rank, model_id):
+    """an opaque search cursor pointing after a result"""
+    return base64.urlsafe_b64encode(json.dumps([rank, model_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """decodes a search cursor into a (rank, id) pair, raises ValueError if invalid"""
+    try:
+        rank, model_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, binascii.Error, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(rank, (int, float)) or not isinstance(model_id, int):
+        raise ValueError('Invalid cursor')
+    return rank, model_id
+
+
 @bp.route('/search', methods=['POST'])
+@replicas.read_only(methods=['POST'])
 def search():
-    """full-text search models"""
+    """full-text search models, ranked by relevance.
+    pass the `next` cursor of a page as `cursor` to get the next page"""
     data = request.get_json()
     query = data['query']
-    results = Model.query.search(query, sort=True).limit(50)
-    return jsonify(results=[{
+    cursor = data.get('cursor')
+    page_size = current_app.config['SEARCH_PAGE_SIZE']
+    try:
+        limit = min(int(data.get('limit', page_size)), page_size)
+        after = decode_cursor(cursor) if cursor is not None else None
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+
+    key = ('search', query, cursor, limit)
+    page = current_app.search_cache.get(key)
+    if page is None:
+        with metrics.timed('search'):
+            rows = Model.query.search_page(query, after=after, limit=limit + 1)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        page = {
+            'results': [model_summary(model) for model, _ in rows],
+            'next': encode_cursor(rows[-1][1], rows[-1][0].id) if more else None
+        }
+        current_app.search_cache.set(key, page)
+    return jsonify(**page)
+
+
+@bp.route('/complete')
+@replicas.read_only()
+def complete():
+    """names of models starting with a prefix, for autocompletion"""
+    prefix = request.args.get('prefix', '')
+    if not prefix:
+        return jsonify(results=[])
+
+    key = ('complete', prefix)
+    results = current_app.search_cache.get(key)
+    if results is None:
+        # escape LIKE wildcards, so only the prefix index is needed
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with metrics.timed('complete'):
+            rows = db.session.query(Model.name, Model.latest_version) \
+                .filter(Model.name.like(pattern, escape='\\')) \
+                .order_by(Model.name) \
+                .limit(current_app.config['COMPLETE_LIMIT']).all()
+        results = [{'name': name, 'version': version} for name, version in rows]
+        current_app.search_cache.set(key, results)
+    return jsonify(results=results)
+
+
+def model_summary(model):
+    """listing representation of a model,
+    built only from the model row (no repo access)"""
+    return {
         'name': model.name,
-        'version': model.latest,
+        'version': model.latest_version,
+        'size': model.latest_size,
         'description': model.description,
+        'summary': model.summary or {},
         'updated_at': model.updated_at.isoformat()
-    } for model in results])
\ No newline at end of file
+    }
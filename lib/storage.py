@@ -0,0 +1,159 @@
+import os
+import shutil
+import logging
+from os import path
+from sqlalchemy import event
+from lib.db import RoutingSession
+
+logger = logging.getLogger(__name__)
+
+
+class LocalStorage(object):
+    """stores blobs as files under a local root directory"""
+
+    # blobs are laid out like model directories on the local filesystem
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        """path of the blob on the local filesystem"""
+        return path.join(self.root, *key.split('/'))
+
+    def put(self, key, src_path, content_type=None, content_encoding=None):
+        """moves a local file into storage"""
+        dest_path = self.local_path(key)
+        parent = path.dirname(dest_path)
+        if not path.exists(parent):
+            os.makedirs(parent)
+        shutil.move(src_path, dest_path)
+
+    def open(self, key):
+        return open(self.local_path(key), 'rb')
+
+    def exists(self, key):
+        return path.exists(self.local_path(key))
+
+    def size(self, key):
+        return path.getsize(self.local_path(key))
+
+    def delete(self, key):
+        if self.exists(key):
+            os.remove(self.local_path(key))
+
+    def delete_prefix(self, prefix):
+        """deletes all blobs under a prefix"""
+        prefix_path = self.local_path(prefix)
+        if path.exists(prefix_path):
+            shutil.rmtree(prefix_path)
+
+    def url(self, key, expires):
+        """local blobs have no urls"""
+        return None
+
+
+class S3Storage(object):
+    """stores blobs in an S3-compatible object store,
+    through a boto3 (or compatible) client"""
+
+    local = False
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def local_path(self, key):
+        return None
+
+    def put(self, key, src_path, content_type=None, content_encoding=None):
+        """uploads a local file into storage (and removes it)"""
+        extra_args = {}
+        if content_type is not None:
+            extra_args['ContentType'] = content_type
+        if content_encoding is not None:
+            extra_args['ContentEncoding'] = content_encoding
+        self.client.upload_file(src_path, self.bucket, self._key(key), ExtraArgs=extra_args)
+        os.remove(src_path)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except Exception as e:
+            # botocore's ClientError, w/o depending on botocore
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        return self._head(key)['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def delete_prefix(self, prefix):
+        """deletes all blobs under a prefix"""
+        kwargs = {'Bucket': self.bucket, 'Prefix': self._key(prefix.rstrip('/') + '/')}
+        while True:
+            resp = self.client.list_objects_v2(**kwargs)
+            objects = [{'Key': obj['Key']} for obj in resp.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects})
+            if not resp.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = resp['NextContinuationToken']
+
+    def url(self, key, expires):
+        """a pre-signed download url for the blob"""
+        return self.client.generate_presigned_url('get_object',
+                                                  Params={'Bucket': self.bucket, 'Key': self._key(key)},
+                                                  ExpiresIn=expires)
+
+
+def from_config(config):
+    """builds the archive storage configured by `ARCHIVE_STORAGE`"""
+    if config['ARCHIVE_STORAGE'] == 's3':
+        import boto3
+        client = boto3.client('s3', endpoint_url=config['ARCHIVE_S3_ENDPOINT_URL'])
+        return S3Storage(client, config['ARCHIVE_S3_BUCKET'], config['ARCHIVE_S3_PREFIX'])
+    return LocalStorage(config['ARCHIVE_DIR'])
+
+
+def delete_on_commit(session, key, prefix=False):
+    """deletes a blob (with `prefix`, all blobs under a prefix) from
+    the archive storage once the session commits, and not at all if it
+    rolls back, so committed rows never point at deleted blobs"""
+    session.info.setdefault('storage_deletes', []).append((key, prefix))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.transaction is not None and session.transaction.nested:
+        # a savepoint, the deletes wait for the enclosing transaction
+        return
+    storage = session.app.archive_storage
+    for key, prefix in session.info.pop('storage_deletes', ()):
+        try:
+            if prefix:
+                storage.delete_prefix(key)
+            else:
+                storage.delete(key)
+        except Exception:
+            # the rows are gone, so the blobs are only leaked
+            logger.exception('Failed to delete {} from archive storage'.format(key))
+
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _after_soft_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('storage_deletes', None)
@@ -0,0 +1,26 @@
+import os
+import hashlib
+import tempfile
+from lib.excs import ChecksumMismatchException
+
+
+def receive(stream, dir, digest, chunk_size):
+    """streams an upload to a temporary file in `dir`,
+    checking its sha256 against the expected hex digest.
+    returns the path of the temporary file"""
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=dir, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                f.write(chunk)
+        if sha.hexdigest() != digest.lower():
+            raise ChecksumMismatchException('Checksum mismatch, got sha256 {}'.format(sha.hexdigest()))
+    except:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
@@ -0,0 +1,149 @@
+import re
+import operator
+from bisect import bisect_left, bisect_right
+
+# numeric components are zero-padded to this width
+# so that version keys sort correctly as plain strings
+KEY_WIDTH = 10
+
+# markers which sort version keys (as strings, also in SQL collations
+# which ignore punctuation): a prerelease sorts before its release,
+# which sorts before any version with more numeric components
+PRERELEASE = 'a'
+RELEASE = 'b'
+NUMBER = 'n'
+
+component_re = re.compile(r'\d+|[a-zA-Z]+')
+clause_re = re.compile(r'^\s*(==|!=|>=|<=|>|<|~|\^)?\s*([0-9A-Za-z][^\s,]*)\s*$')
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt
+}
+
+
+def parse(version):
+    """splits a version string into its release (the leading numeric
+    components, dropping trailing zeros so that 1.0 == 1.0.0) and its
+    prerelease (the components from the first alphabetic one on, if any)"""
+    parts = [int(p) if p.isdigit() else p.lower()
+             for p in component_re.findall(version)]
+    i = 0
+    while i < len(parts) and isinstance(parts[i], int):
+        i += 1
+    release, prerelease = parts[:i], parts[i:]
+    while release and release[-1] == 0:
+        release.pop()
+    return release, prerelease
+
+
+def pad(number):
+    """zero-pads a numeric component to the key width.
+    raises ValueError if it doesn't fit"""
+    padded = str(number).zfill(KEY_WIDTH)
+    if len(padded) > KEY_WIDTH:
+        raise ValueError('Version components are limited to {} digits'.format(KEY_WIDTH))
+    return padded
+
+
+def sort_key(version):
+    """returns a string key for the version which sorts
+    in version order (both in python and in SQL), e.g.
+    1.0.0-rc1 < 1.0.0 < 1.0.1. raises ValueError for numeric
+    components longer than `KEY_WIDTH` digits"""
+    release, prerelease = parse(version)
+    parts = [NUMBER + pad(p) for p in release]
+    if prerelease:
+        parts.append(PRERELEASE)
+        parts.extend(pad(p) if isinstance(p, int) else p for p in prerelease)
+    else:
+        parts.append(RELEASE)
+    return '.'.join(parts)
+
+
+def upper_bound(version, op):
+    """the exclusive upper bound of a tilde or caret range, e.g.
+    ~1.4.2 -> 1.5, ~1 -> 2, ^1.4.2 -> 2, ^0.4.2 -> 0.5"""
+    numbers = []
+    for p in component_re.findall(version):
+        if not p.isdigit():
+            break
+        numbers.append(int(p))
+
+    if op == '~':
+        # allow changes below the minor version (or the major, if that's all there is)
+        prefix = numbers[:2] if len(numbers) > 1 else numbers
+    else:
+        # allow changes below the first non-zero component
+        nonzero = [i for i, n in enumerate(numbers) if n != 0]
+        prefix = numbers[:nonzero[0] + 1] if nonzero else numbers
+    prefix[-1] += 1
+    return '.'.join(str(n) for n in prefix)
+
+
+def parse_constraint(constraint):
+    """parses a version constraint such as `>=1.2,<2` or `~1.4`
+    into a list of (operator, sort key) clauses.
+    a bare version means an exact match"""
+    clauses = []
+    for part in constraint.split(','):
+        match = clause_re.match(part)
+        if match is None:
+            raise ValueError('Invalid version constraint: {}'.format(constraint))
+        op, version = match.groups()
+        if op in ('~', '^'):
+            if not version[0].isdigit():
+                raise ValueError('Invalid version constraint: {}'.format(constraint))
+            clauses.append((operator.ge, sort_key(version)))
+            clauses.append((operator.lt, sort_key(upper_bound(version, op))))
+        else:
+            clauses.append((OPERATORS[op or '=='], sort_key(version)))
+    return clauses
+
+
+class VersionIndex(object):
+    """a model's versions sorted by their sort keys,
+    so that constraints resolve by binary search"""
+
+    def __init__(self, keyed_versions):
+        """expects (sort key, version) pairs"""
+        keyed_versions = sorted(keyed_versions)
+        self.keys = [key for key, _ in keyed_versions]
+        self.versions = [version for _, version in keyed_versions]
+
+    @property
+    def latest(self):
+        return self.versions[-1] if self.versions else None
+
+    def resolve(self, constraint):
+        """returns the newest version which satisfies the constraint, or None"""
+        lo, hi, excluded = 0, len(self.keys), set()
+        for op, key in parse_constraint(constraint):
+            if op is operator.ge:
+                lo = max(lo, bisect_left(self.keys, key))
+            elif op is operator.gt:
+                lo = max(lo, bisect_right(self.keys, key))
+            elif op is operator.le:
+                hi = min(hi, bisect_right(self.keys, key))
+            elif op is operator.lt:
+                hi = min(hi, bisect_left(self.keys, key))
+            elif op is operator.eq:
+                lo = max(lo, bisect_left(self.keys, key))
+                hi = min(hi, bisect_right(self.keys, key))
+            else:
+                excluded.add(key)
+
+        for i in range(hi - 1, lo - 1, -1):
+            if self.keys[i] not in excluded:
+                return self.versions[i]
+        return None
+
+
+def resolve(versions, constraint):
+    """returns the newest of the versions
+    which satisfies the constraint, or None"""
+    return VersionIndex((sort_key(v), v) for v in versions).resolve(constraint)
@@ -0,0 +1,98 @@
+import time
+import logging
+import argparse
+import flask_migrate
+from os import path
+from flask import current_app
+from lib import create_app, chunks, layout, maintenance
+from lib.db import db
+from lib.models import Model
+
+parser = argparse.ArgumentParser(description='server management commands')
+subparsers = parser.add_subparsers(dest='command')
+
+
+def upgrade_db(args):
+    """applies the schema migrations to the database"""
+    flask_migrate.upgrade(directory=path.join(path.dirname(path.abspath(__file__)), 'migrations'))
+
+cmd = subparsers.add_parser('upgrade_db', help=upgrade_db.__doc__)
+cmd.set_defaults(func=upgrade_db)
+
+
+def backfill_versions(args):
+    """builds the version index from existing repos"""
+    for model in Model.query.order_by(Model.name):
+        if model.repo is None:
+            print('skipping {} (no repo)'.format(model.name))
+            continue
+        skipped = model.reindex()
+        db.session.add(model)
+        db.session.commit()
+        print('indexed {} ({} versions)'.format(model.name, len(model.versions)))
+        for tag in skipped:
+            print('skipped tag {} of {} (not a valid version)'.format(tag, model.name))
+
+cmd = subparsers.add_parser('backfill_versions', help=backfill_versions.__doc__)
+cmd.set_defaults(func=backfill_versions)
+
+
+def migrate_layout(args):
+    """moves model repos and archives to the sharded layout"""
+    if current_app.config['STORAGE_LAYOUT'] != 'sharded':
+        parser.error('Set STORAGE_LAYOUT to \'sharded\' before migrating')
+
+    for model in Model.query.order_by(Model.name):
+        # no publishes, deletes or archive bookkeeping while the model moves
+        model.lock()
+        for root in [current_app.config['REPO_DIR'], current_app.config['ARCHIVE_DIR']]:
+            if layout.migrate(root, model.name):
+                print('moved {} to {}'.format(path.join(root, model.name),
+                                              path.join(root, layout.shard(model.name))))
+        db.session.commit()
+
+cmd = subparsers.add_parser('migrate_layout', help=migrate_layout.__doc__)
+cmd.set_defaults(func=migrate_layout)
+
+
+def maintain(args):
+    """repacks repos, applies archive retention policies
+    and deletes unreferenced chunks"""
+    while True:
+        query = Model.query.order_by(Model.name)
+        if args.model is not None:
+            query = query.filter_by(name=args.model)
+        for model in query.all():
+            report = maintenance.maintain(model, rebuild=args.rebuild)
+            if 'skipped' in report:
+                print('skipping {} ({})'.format(model.name, report['skipped']))
+                continue
+            print('{}: {} loose objects{}'.format(model.name, report['loose_objects'],
+                                                 ', repacked' if report['repacked'] else ''))
+            for version in report['pruned']:
+                print('  pruned archive of {}'.format(version))
+            for version in report['missing']:
+                print('  {} archive of {}'.format('rebuilt' if args.rebuild else 'pruned missing', version))
+            for version in report['stale']:
+                print('  {} archive of {}'.format('rebuilt' if args.rebuild else 'pruned stale', version))
+        print('deleted {} unreferenced chunks'.format(chunks.collect()))
+        if not args.loop:
+            break
+        time.sleep(current_app.config['MAINTENANCE_INTERVAL'])
+
+cmd = subparsers.add_parser('maintain', help=maintain.__doc__)
+cmd.add_argument('--model', help='only maintain this model')
+cmd.add_argument('--rebuild', action='store_true', help='rebuild missing archives and lost builds right away')
+cmd.add_argument('--loop', action='store_true', help='run every MAINTENANCE_INTERVAL seconds')
+cmd.set_defaults(func=maintain)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('Tell me what to do...')
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_app()
+    with app.app_context():
+        args.func(args)
@@ -0,0 +1,40 @@
+"""make (model_id, version) unique in model_version
+
+Revision ID: 0c352f63cf84
+Revises: dc0f52714222
+Create Date: 2026-10-17 06:34:05
+
+versions published twice by concurrent requests (before publishes were
+serialized by the model lock) have to be deleted first, so the migration
+stops and lists them rather than picking one
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0c352f63cf84'
+down_revision = 'dc0f52714222'
+
+from alembic import op
+import sqlalchemy as sa
+
+NAME = 'model_version_model_id_version_key'
+
+
+def upgrade():
+    bind = op.get_bind()
+    constraints = [c['name'] for c in sa.inspect(bind).get_unique_constraints('model_version')]
+    if NAME in constraints:
+        return
+
+    model_version = sa.table('model_version', sa.column('model_id'), sa.column('version'))
+    duplicates = bind.execute(sa.select([model_version.c.model_id, model_version.c.version])
+                              .group_by(model_version.c.model_id, model_version.c.version)
+                              .having(sa.func.count() > 1)).fetchall()
+    if duplicates:
+        raise Exception('Duplicate model versions: {}'.format(
+            ', '.join('{} {}'.format(*row) for row in duplicates)))
+    op.create_unique_constraint(NAME, 'model_version', ['model_id', 'version'])
+
+
+def downgrade():
+    op.drop_constraint(NAME, 'model_version', type_='unique')
@@ -0,0 +1,26 @@
+"""add the latest version sha of model
+
+Revision ID: 45b2c9ccd158
+Revises: 843aa0b6f538
+Create Date: 2026-10-17 06:23:09
+
+filled in by `manage.py backfill_versions`
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '45b2c9ccd158'
+down_revision = '843aa0b6f538'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    existing = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('model')]
+    if 'latest_sha' not in existing:
+        op.add_column('model', sa.Column('latest_sha', sa.String(length=40), nullable=True))
+
+
+def downgrade():
+    op.drop_column('model', 'latest_sha')
@@ -0,0 +1,35 @@
+"""add the model_version table (the version index)
+
+Revision ID: 55341f83abe8
+Revises: 95e5e89a7fdd
+Create Date: 2026-10-17 06:18:26
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '55341f83abe8'
+down_revision = '95e5e89a7fdd'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    if 'model_version' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('model_version',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('model_id', sa.Integer(), nullable=True),
+                    sa.Column('version', sa.Unicode(length=255), nullable=True),
+                    sa.Column('sort_key', sa.Unicode(), nullable=True),
+                    sa.Column('sha', sa.String(length=40), nullable=True),
+                    sa.Column('archive_path', sa.Unicode(length=255), nullable=True),
+                    sa.Column('size', sa.BigInteger(), nullable=True),
+                    sa.Column('created_at', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['model_id'], ['model.id']),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_model_version_model_id', 'model_version', ['model_id'])
+
+
+def downgrade():
+    op.drop_table('model_version')
@@ -0,0 +1,43 @@
+"""index model_version by (model_id, sort_key), and recompute the sort keys
+
+Revision ID: 6c881875062f
+Revises: 8c59ff71a4c2
+Create Date: 2026-10-17 06:27:16
+
+constraints are resolved in the database over the index. sort keys are
+recomputed in the current format, in which prereleases sort before their
+release. versions with components too long for the format keep their key
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6c881875062f'
+down_revision = '8c59ff71a4c2'
+
+from alembic import op
+import sqlalchemy as sa
+from lib.versions import sort_key
+
+
+def upgrade():
+    bind = op.get_bind()
+    indexes = [i['name'] for i in sa.inspect(bind).get_indexes('model_version')]
+    if 'ix_model_version_sort_key' not in indexes:
+        op.create_index('ix_model_version_sort_key', 'model_version', ['model_id', 'sort_key'])
+    if 'ix_model_version_model_id' in indexes:
+        # covered by the new index
+        op.drop_index('ix_model_version_model_id', 'model_version')
+
+    model_version = sa.table('model_version', sa.column('id'), sa.column('version'), sa.column('sort_key'))
+    rows = bind.execute(sa.select([model_version.c.id, model_version.c.version])).fetchall()
+    for id, version in rows:
+        try:
+            key = sort_key(version)
+        except ValueError:
+            continue
+        bind.execute(model_version.update().where(model_version.c.id == id).values(sort_key=key))
+
+
+def downgrade():
+    op.create_index('ix_model_version_model_id', 'model_version', ['model_id'])
+    op.drop_index('ix_model_version_sort_key', 'model_version')
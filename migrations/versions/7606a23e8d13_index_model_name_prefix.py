@@ -0,0 +1,28 @@
+"""index model names for prefix searches
+
+Revision ID: 7606a23e8d13
+Revises: d80b17be592e
+Create Date: 2026-10-17 06:39:06
+
+text_pattern_ops lets LIKE 'prefix%' use the index whatever the
+database's collation
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7606a23e8d13'
+down_revision = 'd80b17be592e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    indexes = [i['name'] for i in sa.inspect(op.get_bind()).get_indexes('model')]
+    if 'ix_model_name_prefix' not in indexes:
+        op.create_index('ix_model_name_prefix', 'model', ['name'],
+                        postgresql_ops={'name': 'text_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_model_name_prefix', 'model')
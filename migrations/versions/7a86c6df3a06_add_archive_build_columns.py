@@ -0,0 +1,37 @@
+"""add the archive build columns of model_version
+
+Revision ID: 7a86c6df3a06
+Revises: a1b1e9643adc
+Create Date: 2026-10-17 06:20:27
+
+archives built before builds were tracked are ready
+if they were built, and failed otherwise
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a86c6df3a06'
+down_revision = 'a1b1e9643adc'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    existing = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('model_version')]
+    for column in [sa.Column('build_id', sa.String(length=32), nullable=True),
+                   sa.Column('archive_status', sa.String(length=16), nullable=True),
+                   sa.Column('queued_at', sa.DateTime(), nullable=True)]:
+        if column.name not in existing:
+            op.add_column('model_version', column)
+
+    op.execute("UPDATE model_version SET archive_status = 'ready' "
+               "WHERE archive_status IS NULL AND archive_path IS NOT NULL")
+    op.execute("UPDATE model_version SET archive_status = 'failed' "
+               "WHERE archive_status IS NULL")
+
+
+def downgrade():
+    op.drop_column('model_version', 'queued_at')
+    op.drop_column('model_version', 'archive_status')
+    op.drop_column('model_version', 'build_id')
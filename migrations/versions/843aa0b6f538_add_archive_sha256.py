@@ -0,0 +1,26 @@
+"""add the archive content hash of model_version
+
+Revision ID: 843aa0b6f538
+Revises: d4b8eed5a522
+Create Date: 2026-10-17 06:22:05
+
+filled in for existing archives by `manage.py backfill_versions`
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '843aa0b6f538'
+down_revision = 'd4b8eed5a522'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    existing = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('model_version')]
+    if 'sha256' not in existing:
+        op.add_column('model_version', sa.Column('sha256', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('model_version', 'sha256')
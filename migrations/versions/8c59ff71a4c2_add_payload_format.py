@@ -0,0 +1,28 @@
+"""add the payload format of model_version
+
+Revision ID: 8c59ff71a4c2
+Revises: 45b2c9ccd158
+Create Date: 2026-10-17 06:25:59
+
+versions published before binary payloads are json
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c59ff71a4c2'
+down_revision = '45b2c9ccd158'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    existing = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('model_version')]
+    if 'payload_format' not in existing:
+        op.add_column('model_version', sa.Column('payload_format', sa.String(length=16), nullable=True))
+
+    op.execute("UPDATE model_version SET payload_format = 'json' WHERE payload_format IS NULL")
+
+
+def downgrade():
+    op.drop_column('model_version', 'payload_format')
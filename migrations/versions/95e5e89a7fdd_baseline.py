@@ -0,0 +1,27 @@
+"""baseline: the schema as created by db.create_all before migrations
+
+Revision ID: 95e5e89a7fdd
+Revises: None
+Create Date: 2026-10-17 06:18:00
+
+db.create_all() still creates missing tables (at their current schema)
+when the app starts, so the following migrations skip any table, column
+or index that already exists. existing databases are brought up to date
+with `python manage.py upgrade_db`, whatever state they're in.
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '95e5e89a7fdd'
+down_revision = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
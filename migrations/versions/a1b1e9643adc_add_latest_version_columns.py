@@ -0,0 +1,38 @@
+"""add the latest version columns of model, and version summaries
+
+Revision ID: a1b1e9643adc
+Revises: 55341f83abe8
+Create Date: 2026-10-17 06:19:10
+
+the columns are filled by `manage.py backfill_versions`
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a1b1e9643adc'
+down_revision = '55341f83abe8'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utils.types import JSONType
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = [c['name'] for c in inspector.get_columns('model')]
+    for column in [sa.Column('latest_version', sa.Unicode(length=255), nullable=True),
+                   sa.Column('latest_size', sa.BigInteger(), nullable=True),
+                   sa.Column('summary', JSONType(), nullable=True)]:
+        if column.name not in existing:
+            op.add_column('model', column)
+
+    existing = [c['name'] for c in inspector.get_columns('model_version')]
+    if 'summary' not in existing:
+        op.add_column('model_version', sa.Column('summary', JSONType(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('model_version', 'summary')
+    op.drop_column('model', 'summary')
+    op.drop_column('model', 'latest_size')
+    op.drop_column('model', 'latest_version')
@@ -0,0 +1,27 @@
+"""add the precompressed archive variants of model_version
+
+Revision ID: d4b8eed5a522
+Revises: 7a86c6df3a06
+Create Date: 2026-10-17 06:21:04
+
+existing archives have no variants until they are rebuilt
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8eed5a522'
+down_revision = '7a86c6df3a06'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utils.types import JSONType
+
+
+def upgrade():
+    existing = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('model_version')]
+    if 'encodings' not in existing:
+        op.add_column('model_version', sa.Column('encodings', JSONType(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('model_version', 'encodings')
@@ -0,0 +1,32 @@
+"""add the model_change log
+
+Revision ID: d80b17be592e
+Revises: 0c352f63cf84
+Create Date: 2026-10-17 06:35:57
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd80b17be592e'
+down_revision = '0c352f63cf84'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    if 'model_change' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('model_change',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('model_id', sa.Integer(), nullable=True),
+                    sa.Column('model_name', sa.Unicode(length=255), nullable=True),
+                    sa.Column('version', sa.Unicode(length=255), nullable=True),
+                    sa.Column('action', sa.String(length=16), nullable=True),
+                    sa.Column('created_at', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['model_id'], ['model.id'], ondelete='SET NULL'),
+                    sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('model_change')
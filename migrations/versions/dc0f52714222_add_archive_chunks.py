@@ -0,0 +1,34 @@
+"""add the chunk table, and the chunk manifests of model_version
+
+Revision ID: dc0f52714222
+Revises: 6c881875062f
+Create Date: 2026-10-17 06:32:46
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'dc0f52714222'
+down_revision = '6c881875062f'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utils.types import JSONType
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if 'chunk' not in inspector.get_table_names():
+        op.create_table('chunk',
+                        sa.Column('sha256', sa.String(length=64), nullable=False),
+                        sa.Column('size', sa.BigInteger(), nullable=True),
+                        sa.Column('refs', sa.Integer(), nullable=True),
+                        sa.PrimaryKeyConstraint('sha256'))
+
+    existing = [c['name'] for c in inspector.get_columns('model_version')]
+    if 'manifest' not in existing:
+        op.add_column('model_version', sa.Column('manifest', JSONType(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('model_version', 'manifest')
+    op.drop_table('chunk')
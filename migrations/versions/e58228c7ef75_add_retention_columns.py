@@ -0,0 +1,26 @@
+"""add the archive retention policy of models
+
+Revision ID: e58228c7ef75
+Revises: 7606a23e8d13
+Create Date: 2026-10-17 06:40:38
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e58228c7ef75'
+down_revision = '7606a23e8d13'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    existing = [c['name'] for c in sa.inspect(op.get_bind()).get_columns('model')]
+    for name in ['keep_versions', 'keep_days']:
+        if name not in existing:
+            op.add_column('model', sa.Column(name, sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('model', 'keep_days')
+    op.drop_column('model', 'keep_versions')
@@ -0,0 +1,110 @@
+import time
+import unittest
+import threading
+from lib.cache import LRUCache, SharedCache, ThreadLocalCache
+
+
+class FakeRedis(object):
+    """local stand-in for a redis client"""
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.time():
+            return None
+        return value
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value.encode('utf-8'), time.time() + ttl
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_get_set(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        self.assertEquals(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEquals(cache.stats['hits'], 1)
+        self.assertEquals(cache.stats['misses'], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertNotIn('b', cache)
+        self.assertEquals(len(cache), 2)
+
+    def test_invalidate(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.invalidate('a')
+        cache.invalidate('b')
+        self.assertNotIn('a', cache)
+
+    def test_ttl(self):
+        cache = LRUCache(2, ttl=0.01)
+        cache.set('a', 1)
+        self.assertEquals(cache.get('a'), 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+
+    def test_on_evict(self):
+        evicted = []
+        cache = LRUCache(2, on_evict=evicted.append)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEquals(evicted, [1])
+        cache.set('b', 4)
+        cache.invalidate('c')
+        self.assertEquals(evicted, [1, 2, 3])
+        cache.clear()
+        self.assertEquals(evicted, [1, 2, 3, 4])
+
+
+class ThreadLocalCacheTest(unittest.TestCase):
+    def test_per_thread(self):
+        cache = ThreadLocalCache(2)
+        cache.set('a', 1)
+        seen = []
+        def other():
+            seen.append(cache.get('a'))
+            cache.set('a', 2)
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEquals(seen, [None])
+        self.assertEquals(cache.get('a'), 1)
+
+    def test_stats(self):
+        cache = ThreadLocalCache(2)
+        cache.set('a', 1)
+        cache.get('a')
+        threads = [threading.Thread(target=cache.get, args=('a',)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        stats = cache.stats
+        self.assertEquals(stats['hits'], 1)
+        self.assertLessEqual(stats['threads'], 3)
+
+
+class SharedCacheTest(unittest.TestCase):
+    def test_shared_between_instances(self):
+        client = FakeRedis()
+        cache_a = SharedCache(client, 'meta', 60)
+        cache_b = SharedCache(client, 'meta', 60)
+        cache_a.set(('model', '1.0.0'), {'version': '1.0.0'})
+        self.assertEquals(cache_b.get(('model', '1.0.0')), {'version': '1.0.0'})
+
+        cache_b.invalidate(('model', '1.0.0'))
+        self.assertIsNone(cache_a.get(('model', '1.0.0')))
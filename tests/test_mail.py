@@ -0,0 +1,149 @@
+import threading
+import unittest
+import socketserver
+from flask import Flask
+from flask_mail import Mail, Message
+from lib.mailer import MailQueue
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """just enough smtp to receive mail"""
+
+    def reply(self, line):
+        self.wfile.write('{}\r\n'.format(line).encode('ascii'))
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        if server.refuse > 0:
+            server.refuse -= 1
+            self.reply('421 try again later')
+            return
+
+        self.reply('220 localhost')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode('utf-8').strip()
+            verb = line.split(' ', 1)[0].upper()
+            if not line or verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            elif verb == 'RCPT':
+                recipient = line.split(':', 1)[1].strip('<> ')
+                if recipient in server.refuse_recipients:
+                    self.reply(server.refuse_recipients[recipient])
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                data = []
+                for data_line in iter(self.rfile.readline, b'.\r\n'):
+                    data.append(data_line)
+                rejected = [server.reject[r] for r in recipients if r in server.reject]
+                if rejected:
+                    self.reply(rejected[0])
+                else:
+                    server.messages.append((recipients, b''.join(data)))
+                    self.reply('250 ok')
+                recipients = []
+            else:
+                self.reply('250 ok')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    """local stand-in for a mail relay"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.refuse = 0
+        self.reject = {}
+        self.refuse_recipients = {}
+        self.messages = []
+
+
+class MailQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.smtp = SMTPServer()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+
+        self.app = Flask(__name__)
+        self.app.config.update(MAIL_SERVER='127.0.0.1',
+                               MAIL_PORT=self.smtp.server_address[1],
+                               MAIL_DEFAULT_SENDER='king@burgerking.cafe',
+                               MAIL_QUEUE_SIZE=10,
+                               MAIL_BATCH_SIZE=10,
+                               MAIL_RETRIES=2,
+                               MAIL_RETRY_DELAY=0.01)
+        self.mail = Mail(self.app)
+        self.mail_queue = MailQueue(self.app, self.mail)
+
+    def tearDown(self):
+        self.smtp.shutdown()
+        self.smtp.server_close()
+
+    def _messages(self, n):
+        with self.app.app_context():
+            return [Message('Welcome', recipients=['user{}@example.com'.format(i)], body='hi')
+                    for i in range(n)]
+
+    def test_queue(self):
+        for msg in self._messages(3):
+            self.mail_queue.put(msg)
+        self.mail_queue.join()
+        self.assertEquals(sorted(r for r, _ in self.smtp.messages),
+                          [['user0@example.com'], ['user1@example.com'], ['user2@example.com']])
+
+    def test_batch_reuses_connection(self):
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(3)), 3)
+        self.assertEquals(self.smtp.connections, 1)
+        self.assertEquals(len(self.smtp.messages), 3)
+
+    def test_retry(self):
+        self.smtp.refuse = 2
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(2)), 2)
+        self.assertEquals(self.smtp.connections, 3)
+        self.assertEquals(len(self.smtp.messages), 2)
+
+    def test_gives_up(self):
+        self.smtp.refuse = 3
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(1)), 0)
+        self.assertEquals(self.smtp.messages, [])
+
+    def test_rejected_message(self):
+        # a permanent rejection drops only that message
+        self.smtp.reject['user1@example.com'] = '554 rejected'
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(3)), 2)
+        self.assertEquals(self.smtp.connections, 1)
+        self.assertEquals(sorted(r for r, _ in self.smtp.messages),
+                          [['user0@example.com'], ['user2@example.com']])
+
+    def test_deferred_message(self):
+        # a temporary rejection is retried
+        self.smtp.reject['user0@example.com'] = '451 try again later'
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(1)), 0)
+        self.assertEquals(self.smtp.connections, 3)
+
+    def test_refused_recipient(self):
+        self.smtp.refuse_recipients['user1@example.com'] = '550 no such user'
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(3)), 2)
+        self.assertEquals(self.smtp.connections, 1)
+
+    def test_deferred_recipient(self):
+        # a greylisted recipient is retried,
+        # without holding up the mails behind it
+        self.smtp.refuse_recipients['user0@example.com'] = '450 greylisted'
+        with self.app.app_context():
+            self.assertEquals(self.mail_queue.send_batch(self._messages(3)), 2)
+        self.assertEquals(self.smtp.connections, 3)
+        self.assertEquals(sorted(r for r, _ in self.smtp.messages),
+                          [['user1@example.com'], ['user2@example.com']])
@@ -0,0 +1,109 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from lib.storage import LocalStorage, S3Storage
+
+
+class FakeClientError(Exception):
+    """local stand-in for botocore's ClientError"""
+    def __init__(self, code):
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeS3(object):
+    """local stand-in for a boto3 s3 client"""
+    def __init__(self, page_size=1000):
+        self.objects = {}
+        self.page_size = page_size
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, 'rb') as f:
+            self.objects[(bucket, key)] = f.read(), dict(ExtraArgs or {})
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError('NoSuchKey')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError('404')
+        return {'ContentLength': len(self.objects[(Bucket, Key)][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken=''):
+        # continuation tokens are the last key of the previous page
+        keys = sorted(k for b, k in self.objects
+                      if b == Bucket and k.startswith(Prefix) and k > ContinuationToken)
+        page = keys[:self.page_size]
+        resp = {'Contents': [{'Key': k} for k in page],
+                'IsTruncated': len(keys) > self.page_size}
+        if resp['IsTruncated']:
+            resp['NextContinuationToken'] = page[-1]
+        return resp
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete['Objects']:
+            self.objects.pop((Bucket, obj['Key']), None)
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return 'https://s3.example.com/{}/{}?expires={}'.format(Params['Bucket'], Params['Key'], ExpiresIn)
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _file(self, data):
+        fd, path = tempfile.mkstemp(dir=self.dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_local(self):
+        storage = LocalStorage(os.path.join(self.dir, 'root'))
+        src_path = self._file(b'foo')
+        storage.put('model/1.0.0.tar', src_path)
+        self.assertFalse(os.path.exists(src_path))
+        self.assertTrue(storage.exists('model/1.0.0.tar'))
+        self.assertEquals(storage.size('model/1.0.0.tar'), 3)
+        self.assertEquals(storage.local_path('model/1.0.0.tar'),
+                          os.path.join(self.dir, 'root', 'model', '1.0.0.tar'))
+        with storage.open('model/1.0.0.tar') as f:
+            self.assertEquals(f.read(), b'foo')
+        self.assertIsNone(storage.url('model/1.0.0.tar', 60))
+
+        storage.delete_prefix('model')
+        self.assertFalse(storage.exists('model/1.0.0.tar'))
+
+    def test_s3(self):
+        client = FakeS3()
+        storage = S3Storage(client, 'bk', prefix='archives/')
+        storage.put('model/1.0.0.tar.gz', self._file(b'foo'),
+                    content_type='application/x-tar', content_encoding='gzip')
+        self.assertEquals(client.objects[('bk', 'archives/model/1.0.0.tar.gz')],
+                          (b'foo', {'ContentType': 'application/x-tar', 'ContentEncoding': 'gzip'}))
+        self.assertIsNone(storage.local_path('model/1.0.0.tar.gz'))
+        self.assertTrue(storage.exists('model/1.0.0.tar.gz'))
+        self.assertFalse(storage.exists('model/2.0.0.tar.gz'))
+        self.assertEquals(storage.size('model/1.0.0.tar.gz'), 3)
+        self.assertEquals(storage.open('model/1.0.0.tar.gz').read(), b'foo')
+        self.assertIn('archives/model/1.0.0.tar.gz', storage.url('model/1.0.0.tar.gz', 60))
+
+        storage.delete('model/1.0.0.tar.gz')
+        self.assertFalse(storage.exists('model/1.0.0.tar.gz'))
+
+    def test_s3_delete_prefix(self):
+        client = FakeS3(page_size=2)
+        storage = S3Storage(client, 'bk')
+        for key in ['model/1.0.0.tar', 'model/2.0.0.tar', 'model/3.0.0.tar', 'model2/1.0.0.tar']:
+            storage.put(key, self._file(b'foo'))
+        storage.delete_prefix('model')
+        self.assertEquals(list(client.objects), [('bk', 'model2/1.0.0.tar')])
@@ -0,0 +1,41 @@
+import unittest
+from lib import versions
+
+
+class VersionsTest(unittest.TestCase):
+    def test_sort_key(self):
+        ordered = ['0.9', '1.0.0-rc1', '1.0.1', '1.2', '1.10.0', '2.0.0']
+        self.assertEquals(sorted(reversed(ordered), key=versions.sort_key), ordered)
+        self.assertEquals(versions.sort_key('1.0'), versions.sort_key('1.0.0'))
+
+    def test_sort_key_prerelease(self):
+        ordered = ['1.0.0-alpha', '1.0.0-rc1', '1.0.0-rc.2', '1.0.0', '1.0.0.1', '1.0.1-beta', '1.0.1']
+        self.assertEquals(sorted(reversed(ordered), key=versions.sort_key), ordered)
+        self.assertLess(versions.sort_key('1.0.0-rc1'), versions.sort_key('1.0.0'))
+        self.assertEquals(versions.sort_key('1.0-rc1'), versions.sort_key('1.0.0-rc1'))
+        self.assertEquals(versions.resolve(ordered, '<1.0.1'), '1.0.1-beta')
+
+    def test_sort_key_width(self):
+        self.assertLess(versions.sort_key('1.9999999999'), versions.sort_key('2'))
+        self.assertRaises(ValueError, versions.sort_key, '1.10000000000')
+        self.assertRaises(ValueError, versions.parse_constraint, '>=1.10000000000')
+
+    def test_resolve(self):
+        available = ['0.9', '1.0.0', '1.2.0', '1.4.3', '1.10.0', '2.0.0']
+        self.assertEquals(versions.resolve(available, '>=1.2,<2'), '1.10.0')
+        self.assertEquals(versions.resolve(available, '1.2'), '1.2.0')
+        self.assertEquals(versions.resolve(available, '!=2.0.0'), '1.10.0')
+        self.assertIsNone(versions.resolve(available, '>2'))
+
+    def test_resolve_tilde_caret(self):
+        available = ['0.0.3', '0.0.4', '0.2.5', '0.3', '1.4.3', '1.4.9', '1.5.0', '2.0.0']
+        self.assertEquals(versions.resolve(available, '~1.4'), '1.4.9')
+        self.assertEquals(versions.resolve(available, '~1'), '1.5.0')
+        self.assertEquals(versions.resolve(available, '^1.4'), '1.5.0')
+        self.assertEquals(versions.resolve(available, '^0.2'), '0.2.5')
+        self.assertEquals(versions.resolve(available, '^0.0.3'), '0.0.3')
+
+    def test_invalid_constraint(self):
+        self.assertRaises(ValueError, versions.parse_constraint, '>=')
+        self.assertRaises(ValueError, versions.parse_constraint, '=1.0')
+        self.assertRaises(ValueError, versions.parse_constraint, '~a')